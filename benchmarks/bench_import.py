@@ -0,0 +1,119 @@
+#! /usr/bin/env python3
+
+"""
+Benchmark cold import time of cocommon modules
+
+Every module is imported in a fresh interpreter several times, the
+median time is compared with its budget. Heavy optional dependencies
+must not be loaded by the import at all, they are imported on first
+use of the functions needing them.
+
+Usage:
+    python3 bench_import.py                   # exit 1 if over budget
+    python3 bench_import.py --budget-ms 30    # same budget for all
+    python3 bench_import.py -v                # slowest imports too
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# module -> budget in ms
+MODULES = {
+    'cocommon.utils.tricks': 50,
+    'cocommon.quick_config.config_log': 50,
+}
+
+# loaded on first use only
+LAZY = ('pexpect', 'requests', 'paramiko', 'fluent', 'raven', 'msgpack',
+        'zstandard', 'http.client')
+
+SCRIPT = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed * 1000, [m for m in {lazy!r} if m in sys.modules]]))
+'''
+
+
+def _env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [SRC] + [i for i in [env.get('PYTHONPATH')] if i])
+    return env
+
+
+def measure(module, repeat):
+    """Median import time in ms, and lazy modules loaded by the import"""
+    timings = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', SCRIPT.format(module=module, lazy=LAZY)],
+            env=_env())
+        elapsed, loaded = json.loads(output.decode())
+        timings.append(elapsed)
+    timings.sort()
+    return timings[len(timings) // 2], loaded
+
+
+def _import_times(code):
+    """[(cumulative us, module)] of imports run by code, by -X importtime"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        env=_env(), stderr=subprocess.PIPE, check=True)
+    imports = []
+    for line in result.stderr.decode().splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            imports.append((int(fields[1]), fields[2].strip()))
+    return imports
+
+
+def slowest_imports(module, n=10):
+    """[(cumulative us, module)] of the slowest imports of module,
+    leaving out those of the interpreter startup"""
+    startup = set(name for _, name in _import_times('pass'))
+    imports = [i for i in _import_times('import ' + module)
+               if i[1] not in startup]
+    return sorted(imports, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--repeat', type=int, default=7)
+    parser.add_argument('--budget-ms', type=float,
+                        help='budget of every module, MODULES if not given')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print the slowest imports of every module')
+    args = parser.parse_args()
+
+    failures = []
+    print('{:<40} {:>10} {:>10}'.format('module', 'ms', 'budget'))
+    for module, budget in sorted(MODULES.items()):
+        if args.budget_ms is not None:
+            budget = args.budget_ms
+        elapsed, loaded = measure(module, args.repeat)
+        print('{:<40} {:>10.1f} {:>10}'.format(module, elapsed, budget))
+        if elapsed > budget:
+            failures.append('{} took {:.1f} ms > {} ms'.format(
+                module, elapsed, budget))
+        if loaded:
+            failures.append('{} loaded {}'.format(module, ', '.join(loaded)))
+        if args.verbose:
+            for cumulative, name in slowest_imports(module):
+                print('    {:>10.1f} {}'.format(cumulative / 1000.0, name))
+
+    for line in failures:
+        print('REGRESSION ' + line)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
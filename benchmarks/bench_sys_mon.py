@@ -0,0 +1,258 @@
+#! /usr/bin/env python3
+
+"""
+Benchmark sys_mon collectors against /proc fixtures
+
+Fixtures of several sizes (cores, interfaces, disks, mounts) are
+generated, or recorded from a live host with `record`. Every collector
+is timed per call, reporting latency percentiles and memory allocated
+per call, and compared with a stored baseline to catch regressions.
+
+Usage:
+    python3 bench_sys_mon.py                        # run and print
+    python3 bench_sys_mon.py --compare baselines/sys_mon.json
+    python3 bench_sys_mon.py --save-baseline baselines/sys_mon.json
+    python3 bench_sys_mon.py record fixtures/myhost  # record this host
+    python3 bench_sys_mon.py --fixture fixtures/myhost
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+from cocommon.sys_mon import sysstat  # noqa: E402
+from cocommon.sys_mon.sysinfo import SysMon  # noqa: E402
+
+# name -> (cores, interfaces, disks, mounts)
+SIZES = {
+    'small': (4, 4, 4, 8),
+    'medium': (64, 64, 64, 64),
+    'large': (256, 512, 512, 256),
+}
+
+RECORDED_FILES = ('stat', 'meminfo', 'diskstats', 'loadavg', 'net/dev',
+                  'self/mounts', 'pressure/cpu', 'pressure/memory',
+                  'pressure/io')
+
+
+def _write(root, name, content):
+    path = os.path.join(root, name)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def generate_fixture(root, cores, interfaces, disks, mounts):
+    """Write a synthetic /proc under root"""
+    cpu = ' 71629 16549 132174 573280 15806 666 0 0 0 0'
+    lines = ['cpu ' + cpu]
+    lines += ['cpu{}{}'.format(i, cpu) for i in range(cores)]
+    lines += ['intr 5266671 16 3084 0 0 0 0 0 0 1 3184',
+              'ctxt 18558358', 'btime 1400122420', 'processes 4936',
+              'procs_running 2', 'procs_blocked 0',
+              'softirq 1291594 70 669951 569 54212 279315 0 3139']
+    _write(root, 'stat', '\n'.join(lines) + '\n')
+
+    _write(root, 'meminfo', ''.join(
+        '{}: {:>15} kB\n'.format(k, v) for k, v in (
+            ('MemTotal', 16316412), ('MemFree', 1019724),
+            ('MemAvailable', 9983512), ('Buffers', 393328),
+            ('Cached', 8290448), ('SwapCached', 0), ('Active', 9024928))))
+
+    lines = ['Inter-|   Receive                                  |  Transmit',
+             ' face |bytes    packets errs drop fifo frame compressed '
+             'multicast|bytes    packets errs drop fifo colls carrier '
+             'compressed']
+    lines += ['{:>6}: 1104914   10467    0    0    0     0          0'
+              '         0  2039017   12356    0    0    0     0       0'
+              '          0'.format('eth{}'.format(i))
+              for i in range(interfaces)]
+    _write(root, 'net/dev', '\n'.join(lines) + '\n')
+
+    _write(root, 'diskstats', ''.join(
+        '   8  {} sd{} 31478 30 1378226 136396 1015322 2114063 25032864 '
+        '4310788 0 1060004 4447080 0 0 0 0 0 0\n'.format(i, i)
+        for i in range(disks)))
+
+    _write(root, 'self/mounts', ''.join(
+        '/dev/sd{} / ext4 rw,relatime 0 0\n'.format(i)
+        for i in range(mounts)))
+
+    _write(root, 'loadavg', '0.20 0.18 0.12 1/80 11206\n')
+    for resource in sysstat.PRESSURE_RESOURCES:
+        _write(root, 'pressure/' + resource,
+               'some avg10=0.00 avg60=0.00 avg300=0.00 total=0\n'
+               'full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n')
+
+
+def record_fixture(root, proc_root='/proc'):
+    """Copy the files sampled by SysMon from proc_root to root"""
+    for name in RECORDED_FILES:
+        try:
+            with open(os.path.join(proc_root, name), 'rb') as f:
+                content = f.read()
+        except (IOError, OSError):
+            continue
+        _write(root, name, content.decode('utf-8', 'replace'))
+
+
+def collectors(root):
+    """name -> callable, for the fixture at root"""
+    def content(name):
+        with open(os.path.join(root, name), 'rb') as f:
+            return f.read()
+
+    stat, meminfo = content('stat'), content('meminfo')
+    netdev, diskstats = content('net/dev'), content('diskstats')
+    mounts = content('self/mounts')
+    reader = sysstat.ProcStatReader(root)
+    sys_mon = SysMon(proc_root=root, cgroup_root=None, log_interval=None)
+    return {
+        'parse_cpu_stat': lambda: sysstat.parse_cpu_stat(stat),
+        'parse_meminfo': lambda: sysstat.parse_meminfo(meminfo),
+        'parse_network_counters':
+            lambda: sysstat.parse_network_counters(netdev),
+        'parse_diskstats': lambda: sysstat.parse_diskstats(diskstats),
+        'disk_usage_of_mounts': lambda: sysstat.disk_usage_of_mounts(mounts),
+        'reader.read_cpu_usage': lambda: reader.read_cpu_usage(True),
+        'reader.read_network_counters': reader.read_network_counters,
+        'reader.read_disk_io': reader.read_disk_io,
+        'SysMon.get_sys_info': sys_mon.get_sys_info,
+    }
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(q / 100.0 * len(sorted_values)))]
+
+
+def measure(func, iterations, warmup=10):
+    """Latency percentiles in us, and peak KB allocated by one call"""
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(min(iterations, 20)):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        func()
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    return {
+        'p50_us': round(percentile(timings, 50), 2),
+        'p90_us': round(percentile(timings, 90), 2),
+        'p99_us': round(percentile(timings, 99), 2),
+        'alloc_kb': round(max(peaks) / 1024.0, 2),
+    }
+
+
+def run(fixtures, iterations, only=None):
+    """{'<fixture>/<collector>': measurement}"""
+    results = {}
+    for fixture, root in fixtures:
+        for name, func in collectors(root).items():
+            if only and only not in name:
+                continue
+            results['{}/{}'.format(fixture, name)] = measure(
+                func, iterations)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Lines describing regressions beyond threshold (a ratio)"""
+    regressions = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric in ('p50_us', 'alloc_kb'):
+            # ignore noise on tiny numbers
+            floor = 5 if metric == 'p50_us' else 1
+            if result[metric] > max(base[metric], floor) * threshold:
+                regressions.append('{} {}: {} > {} * {}'.format(
+                    key, metric, result[metric], base[metric], threshold))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('command', nargs='?', choices=['run', 'record'],
+                        default='run')
+    parser.add_argument('directory', nargs='?',
+                        help='fixture directory to record into')
+    parser.add_argument('-f', '--fixture', action='append',
+                        help='recorded fixture directory to run against, '
+                        'generated fixtures of every size if not given')
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('-k', '--only', help='only collectors matching')
+    parser.add_argument('--save-baseline', help='write results to file')
+    parser.add_argument('--compare', help='baseline file to compare with')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='max ratio to baseline before failing')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        if not args.directory:
+            parser.error('record requires a directory')
+        record_fixture(args.directory)
+        return 0
+
+    tmp_dir = None
+    if args.fixture:
+        fixtures = [(os.path.basename(os.path.normpath(i)), i)
+                    for i in args.fixture]
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix='bench_sys_mon_')
+        fixtures = []
+        for name, size in SIZES.items():
+            root = os.path.join(tmp_dir, name)
+            generate_fixture(root, *size)
+            fixtures.append((name, root))
+
+    try:
+        results = run(fixtures, args.iterations, args.only)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    print('{:<45} {:>10} {:>10} {:>10} {:>10}'.format(
+        'collector', 'p50 us', 'p90 us', 'p99 us', 'alloc KB'))
+    for key, r in sorted(results.items()):
+        print('{:<45} {p50_us:>10} {p90_us:>10} {p99_us:>10} '
+              '{alloc_kb:>10}'.format(key, **r))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
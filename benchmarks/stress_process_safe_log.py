@@ -0,0 +1,126 @@
+#! /usr/bin/env python3
+
+"""
+Stress test of config_log.ProcessSafeFileHandler
+
+Dozens of forked processes log to one file through one handler created
+before the fork, while the file is rotated every second instead of at
+midnight. Every line of the log file and its backups is then checked:
+none may be lost, duplicated, torn or out of order within its process.
+
+Usage:
+    python3 stress_process_safe_log.py            # exit 1 on failure
+    python3 stress_process_safe_log.py -p 64 -n 5000
+"""
+
+import os
+import re
+import sys
+import math
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+from cocommon.quick_config.config_log import \
+    ProcessSafeFileHandler  # noqa: E402
+
+LINE = re.compile(r'(\d+) (\d+) (x*)\n')
+
+
+class _SecondlyHandler(ProcessSafeFileHandler):
+
+    """Rotated every second"""
+
+    suffix = '%Y%m%d-%H%M%S'
+
+    def _next_rollover(self, t):
+        return math.floor(t) + 1
+
+
+def write(logger, records, pauses):
+    """Log records lines of varying length, pausing now and then so that
+    the processes live through several rotations"""
+    for i in range(records):
+        logger.info('%d %s', i, 'x' * (i % 300))
+        if i % (records // pauses or 1) == 0:
+            time.sleep(0.5)
+
+
+def check(handler, processes, records):
+    """Lines of the log file and backups, and a list of problems"""
+    last = {}  # pid -> last record number
+    problems = []
+    lines = 0
+    for path in handler.backups() + [handler.filename]:
+        with open(path) as f:
+            for line in f:
+                lines += 1
+                m = LINE.fullmatch(line)
+                if not m or len(m.group(3)) != int(m.group(2)) % 300:
+                    problems.append('torn line in {}: {!r}'.format(
+                        path, line[:60]))
+                    continue
+                pid, i = int(m.group(1)), int(m.group(2))
+                if last.get(pid, -1) != i - 1:
+                    problems.append('process {} line {} after {}'.format(
+                        pid, i, last.get(pid)))
+                last[pid] = i
+    if lines != processes * records:
+        problems.append('{} lines, {} expected'.format(
+            lines, processes * records))
+    return lines, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-p', '--processes', type=int, default=40)
+    parser.add_argument('-n', '--records', type=int, default=2000,
+                        help='records logged by every process')
+    parser.add_argument('--pauses', type=int, default=4,
+                        help='pauses of 0.5 s of every process')
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp(prefix='stress_process_safe_log_')
+    try:
+        handler = _SecondlyHandler(os.path.join(log_dir, 'stress.log'),
+                                   back_count=0)
+        handler.setFormatter(logging.Formatter('%(process)d %(message)s'))
+        logger = logging.getLogger('stress_process_safe_log')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+
+        start = time.time()
+        pids = []
+        for _ in range(args.processes):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    write(logger, args.records, args.pauses)
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        failed = sum(1 for pid in pids if os.waitpid(pid, 0)[1])
+        elapsed = time.time() - start
+
+        lines, problems = check(handler, args.processes, args.records)
+        if failed:
+            problems.append('{} processes failed'.format(failed))
+        print('{} processes, {} lines in {} files, {:.1f} s'.format(
+            args.processes, lines, len(handler.backups()) + 1, elapsed))
+    finally:
+        shutil.rmtree(log_dir)
+
+    for line in problems[:20]:
+        print('FAILURE ' + line)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
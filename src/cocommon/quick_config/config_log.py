@@ -1,19 +1,649 @@
 #!/usr/bin/env python3
 
 import os
+import sys
+import gzip
+import json
+import fcntl
+import shutil
 import time
+import queue
+import random
+import signal
+import socket
+import atexit
 import logging
+import threading
+import collections
 import logging.handlers
 
-import fluent.handler
-import raven.handlers.logging
+from operator import attrgetter
+
+import ujson
+
+
+class _QueueListener(logging.handlers.QueueListener):
+
+    def enqueue_sentinel(self):
+        # wait for room rather than failing on a full bounded queue
+        self.queue.put(self._sentinel)
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+
+    """Hand records to other handlers run by a QueueListener thread.
+
+    The caller only pays for putting the record in a bounded queue.
+    The listener is stopped, flushing the queue, by close(), which is
+    called at exit. It then closes the handlers, their own exit hooks
+    are unregistered so that they are not closed before the queue is
+    flushed into them.
+
+    :param handlers: handlers run on the listener thread,
+        each with its own level
+    :param queue_size: max number of records waiting
+    :param queue_full: 'block' to wait for room, 'drop' to discard the
+        record (counted in self.dropped) when the queue is full"""
+
+    def __init__(self, handlers=(), queue_size=10000, queue_full='block'):
+        if queue_full not in ('block', 'drop'):
+            raise ValueError('queue_full must be block or drop')
+        super(AsyncQueueHandler, self).__init__(queue.Queue(queue_size))
+        self.block = queue_full == 'block'
+        self.dropped = 0
+        for h in handlers:
+            atexit.unregister(h.close)
+        self.listener = _QueueListener(
+            self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        self._started = True
+        atexit.register(self.close)
+
+    def prepare(self, record):
+        # the listener is in this process, hand the record as it is, so
+        # that handlers still get msg, args and exc_info (sentry groups
+        # events by msg and reads the exception)
+        return record
+
+    def enqueue(self, record):
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def add_handler(self, handler):
+        """Run one more handler on the listener thread, closed by
+        close()"""
+        atexit.unregister(handler.close)
+        # replace the tuple as a whole, the listener may be iterating it
+        self.listener.handlers = self.listener.handlers + (handler,)
+
+    def close(self):
+        atexit.unregister(self.close)
+        if self._started:
+            self._started = False
+            # processes every record queued so far
+            self.listener.stop()
+            for h in self.listener.handlers:
+                h.close()
+        super(AsyncQueueHandler, self).close()
+
+
+# (key in JSON, LogRecord attribute), message and asctime are formatted
+JSON_FIELDS = (
+    ('time', 'asctime'),
+    ('level', 'levelname'),
+    ('logger', 'name'),
+    ('module', 'module'),
+    ('function', 'funcName'),
+    ('line', 'lineno'),
+    ('message', 'message'),
+)
+
+
+class JSONFormatter(logging.Formatter):
+
+    """Format records as JSON lines with ujson.
+
+    Attributes are fetched at once by a getter prepared from the field
+    list, and serialized by one ujson call. The time is formatted with
+    time.strftime once per second, milliseconds appended.
+    exc_text and stack_info are added when the record has them.
+
+    :param fields: (key, LogRecord attribute) pairs
+    :param extra: dict of constant fields added to every line
+    :param datefmt: strftime format of time"""
+
+    def __init__(self, fields=JSON_FIELDS, extra=None,
+                 datefmt='%Y-%m-%d %H:%M:%S'):
+        super(JSONFormatter, self).__init__(datefmt=datefmt)
+        self.fields = tuple(fields)
+        self.extra = dict(extra or {})
+        self._keys = tuple(k for k, _ in self.fields)
+        self._attributes = tuple(a for _, a in self.fields)
+        self._getter = attrgetter(*self._attributes)
+        if len(self.fields) == 1:
+            getter = self._getter
+            self._getter = lambda record: (getter(record),)
+        self._time_cache = (None, '')  # (second, formatted)
+
+    def formatTime(self, record, datefmt=None):
+        second = int(record.created)
+        cached = self._time_cache
+        if cached[0] != second:
+            # one tuple, so that threads never see half of it updated
+            cached = self._time_cache = (second, time.strftime(
+                datefmt or self.datefmt, self.converter(second)))
+        return '%s.%03d' % (cached[1], record.msecs)
+
+    def format(self, record):
+        record.message = record.getMessage()
+        record.asctime = self.formatTime(record)
+        try:
+            values = self._getter(record)
+        except AttributeError:
+            values = [getattr(record, a, None) for a in self._attributes]
+        data = dict(zip(self._keys, values))
+        if self.extra:
+            data.update(self.extra)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_text'] = record.exc_text
+        if record.stack_info:
+            data['stack_info'] = self.formatStack(record.stack_info)
+        try:
+            return ujson.dumps(data, ensure_ascii=False)
+        except (TypeError, ValueError, OverflowError):
+            return ujson.dumps(
+                {k: v if isinstance(v, (str, int, float, type(None)))
+                 else str(v) for k, v in data.items()},
+                ensure_ascii=False)
+
+
+class _OncePerRecordFilter(logging.Filter):
+
+    """A filter deciding once per record, so that one instance can be
+    shared by several handlers without counting a record twice"""
+
+    def __init__(self):
+        super(_OncePerRecordFilter, self).__init__()
+        self._last = (None, True)  # (record, decision)
+
+    def filter(self, record):
+        last = self._last
+        if last[0] is record:
+            return last[1]
+        decision = self._decide(record)
+        self._last = (record, decision)
+        return decision
+
+    def _decide(self, record):
+        raise NotImplementedError
+
+
+def _note_suppressed(record, count, what):
+    record.msg = '{} [suppressed {} {}]'.format(record.msg, count, what)
+
+
+class RateLimitFilter(_OncePerRecordFilter):
+
+    """Token bucket limit of records of every (logger, level, call site).
+
+    A record passing after some were dropped tells how many.
+
+    :param rate: records per second let through after a burst
+    :param burst: max number of records let through at once
+    :param max_level: records above it always pass"""
+
+    def __init__(self, rate=1.0, burst=10, max_level=logging.WARNING):
+        super(RateLimitFilter, self).__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_level = max_level
+        self._buckets = {}  # key -> [tokens, last time, suppressed]
+
+    def _decide(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.name, record.levelno, record.pathname, record.lineno)
+        now = record.created
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now, 0]
+        else:
+            bucket[0] = min(self.burst,
+                            bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            _note_suppressed(record, bucket[2], 'by rate limit')
+            bucket[2] = 0
+        return True
+
+
+class SamplingFilter(_OncePerRecordFilter):
+
+    """Let through a random fraction of low level records.
+
+    :param rate: fraction of records kept, 0 - 1
+    :param max_level: records above it always pass"""
+
+    def __init__(self, rate=0.1, max_level=logging.INFO):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+        self.max_level = max_level
+
+    def _decide(self, record):
+        return record.levelno > self.max_level or \
+            random.random() < self.rate
+
+
+class DedupFilter(_OncePerRecordFilter):
+
+    """Drop repeats of a record (same logger, level, message and
+    arguments) within window seconds of the last one let through.
+    The next one after the window tells how many were dropped.
+
+    :param window: seconds
+    :param max_keys: max number of distinct records remembered
+    :param max_level: records above it always pass"""
+
+    def __init__(self, window=60, max_keys=10000,
+                 max_level=logging.CRITICAL):
+        super(DedupFilter, self).__init__()
+        self.window = window
+        self.max_keys = max_keys
+        self.max_level = max_level
+        self._seen = {}  # key -> [time let through, suppressed]
+
+    def _decide(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.name, record.levelno, record.msg, record.args)
+        try:
+            seen = self._seen.get(key)
+        except TypeError:
+            # unhashable arguments
+            key = (record.name, record.levelno, record.getMessage())
+            seen = self._seen.get(key)
+        now = record.created
+        if seen is None:
+            if len(self._seen) >= self.max_keys:
+                self._seen.clear()
+            self._seen[key] = [now, 0]
+            return True
+        if now - seen[0] < self.window:
+            seen[1] += 1
+            return False
+        if seen[1]:
+            _note_suppressed(record, seen[1], 'repeats')
+        seen[0] = now
+        seen[1] = 0
+        return True
+
+
+def _add_handler(logger, handler, use_queue=True):
+    """Add handler to logger, behind its AsyncQueueHandler if any
+    and use_queue"""
+    if use_queue:
+        for h in logger.handlers:
+            if isinstance(h, AsyncQueueHandler):
+                h.add_handler(handler)
+                return
+    logger.addHandler(handler)
+
+
+class ProcessSafeFileHandler(logging.Handler):
+
+    """A file handler shared safely by forked or independent processes,
+    rotated at midnight like TimedRotatingFileHandler(when='midnight').
+
+    Every record is written with one os.write() on a O_APPEND file
+    descriptor, so lines of processes never interleave. The process
+    which sees midnight first renames the file to <file>.<date> under
+    an flock() on <file>.lock and deletes old backups, the others find
+    the dated file and only reopen.
+
+    :param filename: log file path
+    :param rotate: rotate at midnight
+    :param back_count: number of rotated files to keep, all if 0
+    :param encoding: encoding of records"""
+
+    suffix = '%Y-%m-%d'
+
+    def __init__(self, filename, rotate=True, back_count=7,
+                 encoding='utf-8'):
+        super(ProcessSafeFileHandler, self).__init__()
+        self.filename = os.path.abspath(filename)
+        self.rotate = rotate
+        self.back_count = back_count
+        self.encoding = encoding
+        self._fd = None
+        self._open()
+        # the file may be from a previous period, rotate it first then
+        self._rollover_at = self._next_rollover(
+            os.fstat(self._fd).st_mtime)
+
+    def _open(self):
+        fd = os.open(self.filename,
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC,
+                     0o644)
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = fd
+
+    def _next_rollover(self, t):
+        """Next midnight after t"""
+        tm = time.localtime(t)
+        return time.mktime((tm.tm_year, tm.tm_mon, tm.tm_mday + 1,
+                            0, 0, 0, 0, 0, -1))
+
+    def backups(self):
+        """Rotated files, oldest first"""
+        directory, base = os.path.split(self.filename)
+        prefix = base + '.'
+        return sorted(os.path.join(directory, i)
+                      for i in os.listdir(directory)
+                      if i.startswith(prefix) and i != prefix + 'lock')
+
+    def _do_rollover(self):
+        backup = '{}.{}'.format(self.filename, time.strftime(
+            self.suffix, time.localtime(self._rollover_at - 1)))
+        # an flock is per open file, open it here rather than sharing
+        # one with forked processes
+        with open(self.filename + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(backup):
+                try:
+                    same = os.stat(self.filename).st_ino == \
+                        os.fstat(self._fd).st_ino
+                except OSError:
+                    same = False
+                if same:
+                    os.rename(self.filename, backup)
+                    if self.back_count > 0:
+                        for i in self.backups()[:-self.back_count]:
+                            os.unlink(i)
+            self._open()
+        self._rollover_at = self._next_rollover(time.time())
+
+    def emit(self, record):
+        try:
+            data = (self.format(record) + '\n').encode(self.encoding)
+            if self.rotate and record.created >= self._rollover_at:
+                self._do_rollover()
+            while data:
+                data = data[os.write(self._fd, data):]
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        with self.lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+        super(ProcessSafeFileHandler, self).close()
+
+
+class CompressingRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+
+    """A file handler rotated by size and/or at midnight, compressing
+    rotated files on a background thread.
+
+    Rotated files are named <file>.<YYYYmmdd-HHMMSS-microseconds> and
+    get a .gz or .zst extension once compressed. Compression and
+    deletion of old files never block the logging call, close() waits
+    for them. Their failures are kept in self.error and written to
+    stderr like those of emit().
+
+    :param filename: log file path
+    :param max_bytes: rotate before the file exceeds it, never if 0
+    :param when: 'midnight' to rotate every day, only by size if None
+    :param back_count: number of rotated files to keep, all if 0
+    :param compress: None | 'gzip' | 'zstd' (needs zstandard)
+    :param max_total_bytes: max size of rotated files together,
+        no limit if 0
+    :param encoding: encoding of the file"""
+
+    def __init__(self, filename, max_bytes=0, when='midnight',
+                 back_count=7, compress=None, max_total_bytes=0,
+                 encoding=None):
+        if when not in (None, 'midnight'):
+            raise ValueError('when must be midnight or None')
+        if compress not in (None, 'gzip', 'zstd'):
+            raise ValueError('compress must be gzip, zstd or None')
+        if compress == 'zstd':
+            import zstandard  # noqa: F401, fail early if missing
+        super(CompressingRotatingFileHandler, self).__init__(
+            filename, 'a', encoding, delay=False)
+        self.max_bytes = max_bytes
+        self.when = when
+        self.back_count = back_count
+        self.compress = compress
+        self.max_total_bytes = max_total_bytes
+        self._rollover_at = None
+        if when is not None:
+            self._rollover_at = self._next_rollover(
+                os.stat(self.baseFilename).st_mtime)
+        self.error = None  # last failure of compression
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name='CompressingRotatingFileHandler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _next_rollover(self, t):
+        """Next midnight after t"""
+        tm = time.localtime(t)
+        return time.mktime((tm.tm_year, tm.tm_mon, tm.tm_mday + 1,
+                            0, 0, 0, 0, 0, -1))
+
+    def shouldRollover(self, record):
+        if self._rollover_at is not None and \
+                record.created >= self._rollover_at:
+            return True
+        if self.max_bytes > 0 and self.stream is not None:
+            size = self.stream.tell()
+            if size and size + len(self.format(record)) + 1 > \
+                    self.max_bytes:
+                return True
+        return False
+
+    def doRollover(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        now = time.time()
+        rotated = '{}.{}-{:06d}'.format(
+            self.baseFilename, time.strftime('%Y%m%d-%H%M%S',
+                                             time.localtime(now)),
+            int(now % 1 * 1e6))
+        if os.path.exists(self.baseFilename):
+            os.rename(self.baseFilename, rotated)
+            self._queue.put(rotated)
+        self.stream = self._open()
+        if self._rollover_at is not None:
+            self._rollover_at = self._next_rollover(now)
+
+    def backups(self):
+        """Rotated files, oldest first"""
+        directory, base = os.path.split(self.baseFilename)
+        prefix = base + '.'
+        return sorted(os.path.join(directory, i)
+                      for i in os.listdir(directory)
+                      if i.startswith(prefix) and
+                      i[len(prefix):len(prefix) + 1].isdigit())
+
+    def _compress(self, path):
+        if self.compress == 'gzip':
+            target = path + '.gz'
+            with open(path, 'rb') as fin, \
+                    gzip.open(target + '.tmp', 'wb', 6) as fout:
+                shutil.copyfileobj(fin, fout, 1 << 20)
+        else:
+            import zstandard
+            target = path + '.zst'
+            with open(path, 'rb') as fin, open(target + '.tmp', 'wb') as fout:
+                zstandard.ZstdCompressor().copy_stream(fin, fout)
+        os.rename(target + '.tmp', target)
+        os.unlink(path)
+
+    def _prune(self):
+        """Delete the oldest rotated files beyond back_count and
+        max_total_bytes"""
+        backups = [i for i in self.backups() if not i.endswith('.tmp')]
+        sizes = [os.path.getsize(i) for i in backups]
+        total = sum(sizes)
+        for i, (path, size) in enumerate(zip(backups, sizes)):
+            left = len(backups) - i
+            if (not self.back_count or left <= self.back_count) and \
+                    (not self.max_total_bytes or
+                     total <= self.max_total_bytes):
+                break
+            os.unlink(path)
+            total -= size
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+            try:
+                # unless pruned meanwhile, after rotations in a burst
+                if self.compress is not None and os.path.exists(path):
+                    self._compress(path)
+                self._prune()
+            except Exception as e:
+                # not through logging, the record could come back to
+                # this handler, whose lock close() may be holding
+                self.error = e
+                if logging.raiseExceptions and sys.stderr:
+                    sys.stderr.write('--- Compressing {} failed: {!r}\n'
+                                     .format(path, e))
+
+    def close(self):
+        with self.lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            # outside the lock, records may still be emitted meanwhile
+            self._queue.put(None)
+            thread.join()
+        super(CompressingRotatingFileHandler, self).close()
+
+
+class FlightRecorderHandler(logging.Handler):
+
+    """Keep the last records in memory, dump them to a file when a record
+    of trigger_level is logged, on dump_signal, or at exit.
+
+    Records are only stored in a preallocated ring, they are formatted
+    when dumped, with the arguments as they are then.
+
+    :param filename: file the dumps are appended to
+    :param capacity: number of records kept
+    :param trigger_level: records of this level and above trigger a dump
+    :param dump_signal: signal triggering a dump, None for none,
+        only installed if created in the main thread. A handler of it
+        installed before is still called, and put back by close()
+    :param dump_at_exit: dump records left at exit
+    :param level: level of records kept"""
+
+    def __init__(self, filename, capacity=10000, trigger_level=logging.ERROR,
+                 dump_signal=signal.SIGUSR1, dump_at_exit=True,
+                 level=logging.DEBUG):
+        super(FlightRecorderHandler, self).__init__(level)
+        self.filename = os.path.abspath(filename)
+        self.capacity = capacity
+        self.trigger_level = trigger_level
+        self._ring = [None] * capacity
+        self._empty = [None] * capacity
+        self._pos = 0
+        self._dump_lock = threading.Lock()
+        self._dump_at_exit = dump_at_exit
+        if dump_at_exit:
+            atexit.register(self._dump_at_exit_func)
+        self._dump_signal = None
+        self._previous_handler = None
+        if dump_signal is not None and \
+                threading.current_thread() is threading.main_thread():
+            self._previous_handler = signal.signal(
+                dump_signal, self._on_signal)
+            self._dump_signal = dump_signal
+
+    def emit(self, record):
+        pos = self._pos
+        self._ring[pos] = record
+        pos += 1
+        self._pos = 0 if pos == self.capacity else pos
+        if record.levelno >= self.trigger_level:
+            self.dump('{} logged'.format(record.levelname))
+
+    def _on_signal(self, signum, frame):
+        # the interrupted code may hold the lock, dump from a thread
+        thread = threading.Thread(target=self.dump, args=(
+            'signal {}'.format(signum),), name='FlightRecorderHandler')
+        thread.daemon = True
+        thread.start()
+        # not SIG_DFL, which would kill the process
+        if callable(self._previous_handler):
+            self._previous_handler(signum, frame)
+
+    def _dump_at_exit_func(self):
+        self.dump('exit')
+
+    def dump(self, reason='requested'):
+        """Append the records kept to the file and forget them,
+        return the number of records dumped"""
+        with self.lock:
+            pos = self._pos
+            records = [r for r in self._ring[pos:] + self._ring[:pos]
+                       if r is not None]
+            self._ring[:] = self._empty
+            self._pos = 0
+        if not records:
+            return 0
+
+        lines = ['--- flight recorder: {} records, {} at {} ---'.format(
+            len(records), reason, time.strftime('%Y-%m-%d %H:%M:%S'))]
+        for record in records:
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                lines.append('<unformattable record {!r}>'.format(record))
+        with self._dump_lock:
+            with open(self.filename, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+        return len(records)
+
+    def close(self):
+        if self._dump_at_exit:
+            atexit.unregister(self._dump_at_exit_func)
+        if self._dump_signal is not None and \
+                threading.current_thread() is threading.main_thread() and \
+                signal.getsignal(self._dump_signal) == self._on_signal:
+            signal.signal(self._dump_signal, signal.SIG_DFL
+                          if self._previous_handler is None
+                          else self._previous_handler)
+            self._dump_signal = None
+        super(FlightRecorderHandler, self).close()
 
 
 def config_log(log_dir=None, log_file=None, log_level='INFO',
                rotate=True, back_count=7, name=None,
                enable_stream_handler=True,
                multithreading=False, multiprocessing=False,
-               log_format=None):
+               log_format=None, use_queue=False, queue_size=10000,
+               queue_full='block', json_format=False, process_safe=False,
+               rate_limit=None, rate_burst=10, sample_rate=None,
+               dedup_window=None, max_bytes=0, compress=None,
+               max_total_bytes=0, flight_recorder=0):
     """Config a default logger.
 
     Will always create log files rotated by day.
@@ -30,17 +660,61 @@ def config_log(log_dir=None, log_file=None, log_level='INFO',
     :param multithreading: add threadId and threadName in log format
     :param multiprocessing: add processId and processName in log format
     :param log_format: if not None, use this format rather than default format
+    :param use_queue: if True, the file and stream handlers run on a
+        background thread behind an AsyncQueueHandler, so logging calls
+        never wait for I/O
+    :param queue_size: max number of records waiting in the queue
+    :param queue_full: block | drop, what to do when the queue is full
+    :param json_format: if True, log JSON lines with a JSONFormatter,
+        log_format is ignored
+    :param process_safe: if True, log to file with a
+        ProcessSafeFileHandler, for many processes logging to one file
+    :param rate_limit: if not None, records per second let through from
+        every call site at WARNING and below by a RateLimitFilter
+    :param rate_burst: records let through at once by rate_limit
+    :param sample_rate: if not None, fraction of DEBUG and INFO records
+        kept by a SamplingFilter
+    :param dedup_window: if not None, seconds during which repeats of a
+        record are dropped by a DedupFilter
+    :param max_bytes: if not 0, also rotate the log file before it
+        exceeds this size, or only by size if not rotate
+    :param compress: None | gzip | zstd, compress rotated log files on a
+        background thread
+    :param max_total_bytes: if not 0, delete the oldest rotated log files
+        beyond this total size
+        max_bytes, compress and max_total_bytes raise ValueError with
+        process_safe, the latter two also without rotate nor max_bytes
+    :param flight_recorder: if not 0, keep this many last records of any
+        level in memory with a FlightRecorderHandler, dumped to
+        <log_file or name>.flight in log_dir on ERROR, SIGUSR1 and exit
     """
 
-    if log_format is None:
-        log_format = '[%(levelname)s]'
+    if json_format:
+        fields = JSON_FIELDS
         if multithreading:
-            log_format += '<t%(thread)d - %(threadName)s>'
+            fields += (('thread', 'thread'), ('thread_name', 'threadName'))
         if multiprocessing:
-            log_format += '<p%(process)d - %(processName)s>'
-        log_format += '<%(module)s>-%(funcName)s: %(message)s --- %(asctime)s'
+            fields += (('process', 'process'),
+                       ('process_name', 'processName'))
+        log_formatter = JSONFormatter(fields)
+    else:
+        if log_format is None:
+            log_format = '[%(levelname)s]'
+            if multithreading:
+                log_format += '<t%(thread)d - %(threadName)s>'
+            if multiprocessing:
+                log_format += '<p%(process)d - %(processName)s>'
+            log_format += \
+                '<%(module)s>-%(funcName)s: %(message)s --- %(asctime)s'
         log_formatter = logging.Formatter(log_format)
 
+    if process_safe and (max_bytes or compress or max_total_bytes):
+        raise ValueError('max_bytes, compress and max_total_bytes are '
+                         'not supported with process_safe')
+    if not rotate and not max_bytes and (compress or max_total_bytes):
+        raise ValueError('compress and max_total_bytes need rotate or '
+                         'max_bytes, nothing would ever be rotated')
+
     if log_dir is None:
         log_dir = '.'
     elif not os.path.isdir(log_dir):
@@ -48,7 +722,14 @@ def config_log(log_dir=None, log_file=None, log_level='INFO',
 
     if log_file is not None:
         log_file = os.path.join(log_dir, log_file)
-        if rotate:
+        if process_safe:
+            loghandler_file = ProcessSafeFileHandler(
+                log_file, rotate, back_count)
+        elif max_bytes or compress or max_total_bytes:
+            loghandler_file = CompressingRotatingFileHandler(
+                log_file, max_bytes, 'midnight' if rotate else None,
+                back_count, compress, max_total_bytes)
+        elif rotate:
             loghandler_file = logging.handlers.TimedRotatingFileHandler(
                 log_file, when='midnight', interval=1, backupCount=back_count)
         else:
@@ -69,15 +750,43 @@ def config_log(log_dir=None, log_file=None, log_level='INFO',
     logger.handlers = []
     logger.setLevel(logging.DEBUG)
 
+    handlers = []
     if log_file is not None:
-        logger.addHandler(loghandler_file)
+        handlers.append(loghandler_file)
     if enable_stream_handler:
-        logger.addHandler(loghandler_stream)
+        handlers.append(loghandler_stream)
+    if use_queue:
+        handlers = [AsyncQueueHandler(handlers, queue_size, queue_full)]
+
+    # on handlers rather than the logger to see records of child loggers,
+    # cheapest first
+    filters = []
+    if sample_rate is not None:
+        filters.append(SamplingFilter(sample_rate))
+    if rate_limit is not None:
+        filters.append(RateLimitFilter(rate_limit, rate_burst))
+    if dedup_window is not None:
+        filters.append(DedupFilter(dedup_window))
+    for h in handlers:
+        for f in filters:
+            h.addFilter(f)
+        logger.addHandler(h)
+
+    if flight_recorder:
+        # neither filtered nor queued, it only stores records
+        flight_file = os.path.join(
+            log_dir, '{}.flight'.format(os.path.basename(
+                log_file or name or 'root')))
+        loghandler_flight = FlightRecorderHandler(
+            flight_file, flight_recorder)
+        loghandler_flight.setFormatter(log_formatter)
+        logger.addHandler(loghandler_flight)
 
     return logger
 
 
-def add_one_time_file_handler(logger, log_dir, log_file, log_level='INFO'):
+def add_one_time_file_handler(logger, log_dir, log_file, log_level='INFO',
+                              use_queue=True):
     """Add a file handler to logger.
 
     The log file created is not rotated
@@ -86,6 +795,7 @@ def add_one_time_file_handler(logger, log_dir, log_file, log_level='INFO'):
     :param log_dir: log directory
     :param log_file: basename of log file under log_dir
     :param log_level: DEBUG | INFO | WARNING | ERROR | CRITICAL
+    :param use_queue: add it behind the AsyncQueueHandler of logger if any
     """
     log_format = '[%(levelname)s]'
     log_format += '<%(module)s>-%(funcName)s: %(message)s --- %(asctime)s'
@@ -93,7 +803,7 @@ def add_one_time_file_handler(logger, log_dir, log_file, log_level='INFO'):
     new_handler = logging.FileHandler(os.path.join(log_dir, log_file))
     new_handler.setFormatter(log_formatter)
     new_handler.setLevel(getattr(logging, log_level.upper()))
-    logger.addHandler(new_handler)
+    _add_handler(logger, new_handler, use_queue)
     return logger
 
 
@@ -108,9 +818,251 @@ class HTTPHandlerWithExtraMessage(logging.handlers.HTTPHandler):
         return record.__dict__
 
 
+class _BatchingHandler(logging.Handler):
+
+    """Base of handlers sending records in batches from a background
+    thread, see BatchingHTTPHandler.
+
+    Subclasses implement _prepare(record), run by the caller, and
+    _send(items), run by the sender thread and raising on failure."""
+
+    def __init__(self, batch_size=500, flush_interval=1.0, max_spool=100000,
+                 timeout=10, max_backoff=60):
+        super(_BatchingHandler, self).__init__()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_spool = max_spool
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.dropped = 0
+        self._spool = collections.deque()
+        self._cond = threading.Condition(threading.Lock())
+        self._sending = 0  # records taken from the spool, not sent yet
+        self._flushing = False
+        self._backing_off = False
+        self._closing = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=type(self).__name__)
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _prepare(self, record):
+        raise NotImplementedError
+
+    def _send(self, items):
+        raise NotImplementedError
+
+    def _requeue(self, items):
+        """Keep items which failed to be sent, to retry them later"""
+        with self._cond:
+            # put them back in front, keeping the newest
+            self._spool.extendleft(
+                reversed([(time.monotonic(), i) for i in items]))
+            while len(self._spool) > self.max_spool:
+                self._spool.popleft()
+                self.dropped += 1
+
+    def _disconnect(self):
+        pass
+
+    def emit(self, record):
+        try:
+            item = self._prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self._cond:
+            if self._closing:
+                # the sender is gone, it would never be sent
+                self.dropped += 1
+                return
+            if len(self._spool) >= self.max_spool:
+                self._spool.popleft()
+                self.dropped += 1
+            self._spool.append((time.monotonic(), item))
+            # the sender waits for the first record, then for a full batch
+            if len(self._spool) in (1, self.batch_size):
+                self._cond.notify()
+
+    def _wait_batch(self):
+        """Wait for a batch to send, None when closed and flushed"""
+        with self._cond:
+            while True:
+                if self._spool:
+                    age = time.monotonic() - self._spool[0][0]
+                    if len(self._spool) >= self.batch_size or \
+                            age >= self.flush_interval or \
+                            self._flushing or self._closing:
+                        break
+                    self._cond.wait(self.flush_interval - age)
+                elif self._closing:
+                    return None
+                else:
+                    self._cond.wait()
+            n = min(self.batch_size, len(self._spool))
+            batch = [self._spool.popleft()[1] for _ in range(n)]
+            self._sending = n
+            return batch
+
+    def _run(self):
+        backoff = 0
+        while True:
+            batch = self._wait_batch()
+            if batch is None:
+                return
+            try:
+                self._send(batch)
+                backoff = 0
+            except Exception as e:
+                self._requeue(batch)
+                with self._cond:
+                    if self._closing:
+                        # give up what is left
+                        self.dropped += len(self._spool)
+                        self._spool.clear()
+                    # flush() gives up until the sink is back, before
+                    # logging, which may wait for a lock held by a
+                    # flush() caller like logging.shutdown()
+                    self._backing_off = True
+                    self._cond.notify_all()
+                logging.getLogger(__name__).debug(
+                    'Sending %d log records from %s failed: %r',
+                    len(batch), type(self).__name__, e)
+                backoff = min(self.max_backoff, backoff * 2 or 1)
+                self._stop.wait(backoff)
+            with self._cond:
+                self._sending = 0
+                self._backing_off = False
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Send every record waiting, wait up to timeout seconds.
+        Return early if sending fails, records are then kept to be
+        retried after a backoff."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flushing = True
+            self._cond.notify_all()
+            while (self._spool or self._sending) and \
+                    not self._backing_off and self._thread.is_alive():
+                remaining = None if deadline is None \
+                    else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._flushing = False
+
+    def close(self):
+        atexit.unregister(self.close)
+        with self._cond:
+            if self._closing:
+                return
+        self.flush(self.timeout)
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._stop.set()
+        self._thread.join(self.timeout)
+        self._disconnect()
+        super(_BatchingHandler, self).close()
+
+
+class BatchingHTTPHandler(_BatchingHandler):
+
+    """Ship records to a HTTP server in batches.
+
+    Records are kept in a bounded spool and sent by a background thread
+    as one JSON array per request, over a persistent connection,
+    when batch_size records are waiting or the oldest one waited
+    flush_interval seconds. Failed requests are retried with exponential
+    backoff, meanwhile the oldest records are dropped (counted in
+    self.dropped) once the spool is full.
+
+    :param host: host:port without protocol
+    :param url: path like '/'
+    :param method: POST | PUT
+    :param secure: use https
+    :param batch_size: max number of records per request
+    :param flush_interval: max seconds a record waits to be sent
+    :param max_spool: max number of records waiting
+    :param compress: gzip the request body
+    :param timeout: seconds to wait for the server
+    :param max_backoff: max seconds between retries
+    :param extra_message: extra message to send with every log record"""
+
+    def __init__(self, host, url, method='POST', secure=False,
+                 batch_size=500, flush_interval=1.0, max_spool=100000,
+                 compress=False, timeout=10, max_backoff=60,
+                 extra_message=None):
+        self.host = host
+        self.url = url
+        self.method = method.upper()
+        self.secure = secure
+        self.compress = compress
+        self.extra_message = extra_message
+        self._connection = None
+        super(BatchingHTTPHandler, self).__init__(
+            batch_size, flush_interval, max_spool, timeout, max_backoff)
+
+    def mapLogRecord(self, record):
+        """The JSON-serializable dict sent for a record"""
+        data = dict(record.__dict__)
+        data['message'] = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+        data['exc_text'] = record.exc_text
+        data['msg'] = data['message']
+        data['args'] = None
+        data['exc_info'] = None
+        data['extra_message'] = self.extra_message
+        return data
+
+    _prepare = mapLogRecord
+
+    def _connect(self):
+        import http.client
+        if self.secure:
+            return http.client.HTTPSConnection(
+                self.host, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _disconnect(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _send(self, items):
+        """Send a batch in one request, raise on failure"""
+        body = json.dumps(items, default=str).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.compress:
+            body = gzip.compress(body, 6)
+            headers['Content-Encoding'] = 'gzip'
+        if self._connection is None:
+            self._connection = self._connect()
+        try:
+            self._connection.request(self.method, self.url, body, headers)
+            response = self._connection.getresponse()
+            # read it all to reuse the connection
+            response.read()
+        except Exception:
+            self._disconnect()
+            raise
+        if response.will_close:
+            self._disconnect()
+        if response.status >= 500:
+            raise IOError('HTTP {} from {}'.format(
+                response.status, self.host))
+        # other errors would fail again, the batch is given up
+
+
 def add_one_time_http_handler(
         logger, remote_http_server, remote_http_path, extra_message=None,
-        method='POST', log_level='INFO'):
+        method='POST', log_level='INFO', use_queue=True, batch=False,
+        batch_size=500, flush_interval=1.0, compress=False):
     """Add a http handler to logger.
 
     :param logger: the logger to add handler to
@@ -119,19 +1071,164 @@ def add_one_time_http_handler(
     :param logger: logger to add new handler to
     :param extra_message: extra message to send with every log record
     :param log_level: DEBUG | INFO | WARNING | ERROR | CRITICAL
+    :param use_queue: add it behind the AsyncQueueHandler of logger if any
+    :param batch: if True, send records in batches of JSON arrays from a
+        background thread with a BatchingHTTPHandler, rather than one
+        request per record
+    :param batch_size: max number of records per request if batch
+    :param flush_interval: max seconds a record waits to be sent if batch
+    :param compress: gzip requests if batch
     """
 
-    new_handler = HTTPHandlerWithExtraMessage(
-        remote_http_server, remote_http_path, method)
-    new_handler.set_extra_message(extra_message)
+    if batch:
+        new_handler = BatchingHTTPHandler(
+            remote_http_server, remote_http_path, method,
+            batch_size=batch_size, flush_interval=flush_interval,
+            compress=compress, extra_message=extra_message)
+    else:
+        new_handler = HTTPHandlerWithExtraMessage(
+            remote_http_server, remote_http_path, method)
+        new_handler.set_extra_message(extra_message)
     new_handler.setLevel(getattr(logging, log_level.upper()))
-    logger.addHandler(new_handler)
+    _add_handler(logger, new_handler, use_queue)
     return logger
 
 
+class BufferedFluentHandler(_BatchingHandler):
+
+    """Ship records to fluentd in batches, in the PackedForward mode of
+    the forward protocol: [tag, packed entries, {'size': n}].
+
+    Records are packed by the caller and sent by a background thread
+    when batch_size are waiting or the oldest one waited flush_interval
+    seconds. When fluentd is unreachable, batches are written to files
+    in spool_dir, sent again oldest first once it is back, even by
+    another process using the same spool_dir later. Without spool_dir,
+    they are kept in memory up to max_spool records.
+
+    Needs msgpack, a dependency of fluent-logger.
+
+    :param tag: tag of the records
+    :param host: host of fluentd
+    :param port: port of fluentd forward input
+    :param batch_size: max number of records per message
+    :param flush_interval: max seconds a record waits to be sent
+    :param max_spool: max number of records waiting in memory
+    :param spool_dir: directory of batches not sent yet, used by one
+        handler at a time
+    :param spool_max_bytes: max size of spool_dir, oldest batches are
+        dropped beyond
+    :param timeout: seconds to connect and send
+    :param max_backoff: max seconds between retries"""
+
+    def __init__(self, tag, host='127.0.0.1', port=24224, batch_size=1000,
+                 flush_interval=1.0, max_spool=100000, spool_dir=None,
+                 spool_max_bytes=1 << 30, timeout=3, max_backoff=60):
+        import msgpack
+        self.tag = tag
+        self.host = host
+        self.port = port
+        self.spool_dir = spool_dir
+        self.spool_max_bytes = spool_max_bytes
+        self._packer = msgpack.Packer()  # by callers, under self.lock
+        self._sender_packer = msgpack.Packer()  # by the sender thread
+        self._socket = None
+        self._backoff = 0
+        self._retry_at = 0
+        self._spooled = 0  # number of spool files written
+        if spool_dir is not None and not os.path.isdir(spool_dir):
+            os.makedirs(spool_dir)
+        super(BufferedFluentHandler, self).__init__(
+            batch_size, flush_interval, max_spool, timeout, max_backoff)
+
+    def _prepare(self, record):
+        data = self.format(record)
+        if not isinstance(data, dict):
+            data = {'message': data}
+        return self._packer.pack([int(record.created), data])
+
+    def _connect(self):
+        return socket.create_connection(
+            (self.host, self.port), self.timeout)
+
+    def _disconnect(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _write(self, message):
+        if self._socket is None:
+            self._socket = self._connect()
+        try:
+            self._socket.sendall(message)
+        except Exception:
+            self._disconnect()
+            raise
+
+    def _spool_files(self):
+        """Spooled batch files, oldest first"""
+        return sorted(i for i in os.listdir(self.spool_dir)
+                      if i.endswith('.msgpack'))
+
+    def _spill(self, message, size):
+        """Write a message of size records to spool_dir"""
+        self._spooled += 1
+        name = '{:020d}-{:06d}-{}.msgpack'.format(
+            time.time_ns(), self._spooled % 1000000, size)
+        path = os.path.join(self.spool_dir, name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(message)
+        os.rename(path + '.tmp', path)
+
+        files = self._spool_files()
+        sizes = [os.path.getsize(os.path.join(self.spool_dir, i))
+                 for i in files]
+        total = sum(sizes)
+        for name, file_size in zip(files, sizes):
+            if total <= self.spool_max_bytes:
+                break
+            os.unlink(os.path.join(self.spool_dir, name))
+            total -= file_size
+            self.dropped += int(name[:-len('.msgpack')].rsplit('-', 1)[1])
+
+    def _replay(self):
+        """Send spooled batches, oldest first"""
+        for name in self._spool_files():
+            path = os.path.join(self.spool_dir, name)
+            with open(path, 'rb') as f:
+                self._write(f.read())
+            os.unlink(path)
+
+    def _send(self, items):
+        message = self._sender_packer.pack(
+            [self.tag, b''.join(items), {'size': len(items)}])
+        if self.spool_dir is None:
+            self._write(message)
+            return
+
+        # with a spool, keep order by sending spooled batches first,
+        # and back off without holding records in memory
+        if time.monotonic() >= self._retry_at:
+            try:
+                self._replay()
+                self._write(message)
+                self._backoff = 0
+                return
+            except Exception as e:
+                self._backoff = min(self.max_backoff,
+                                    self._backoff * 2 or 1)
+                self._retry_at = time.monotonic() + self._backoff
+                logging.getLogger(__name__).debug(
+                    'Sending log records to fluentd %s:%s failed: %r',
+                    self.host, self.port, e)
+        self._spill(message, len(items))
+
+
 def add_fluent_logger_handler(
         logger, tag, host='127.0.0.1', port=24224,
-        extra_message=None, log_level='INFO'):
+        extra_message=None, log_level='INFO', use_queue=True,
+        buffered=False, spool_dir=None, batch_size=1000,
+        flush_interval=1.0):
     """Add a fluent-loghandler to logger.
 
     :param logger: the logger to add handler to
@@ -141,7 +1238,16 @@ def add_fluent_logger_handler(
     :param extra_message: extra message to send with log message
         can be str or dict
     :param log_level: DEBUG | INFO | WARNING | ERROR | CRITICAL
+    :param use_queue: add it behind the AsyncQueueHandler of logger if any
+    :param buffered: if True, send records in batches from a background
+        thread with a BufferedFluentHandler
+    :param spool_dir: directory to keep batches in while fluentd is
+        unreachable if buffered, in memory if None
+    :param batch_size: max number of records per message if buffered
+    :param flush_interval: max seconds a record waits to be sent
+        if buffered
     """
+    import fluent.handler
     custom_format = {
         'host': '%(hostname)s',
         'level': '%(levelname)s',
@@ -156,25 +1262,32 @@ def add_fluent_logger_handler(
         custom_format.update(extra_message)
     else:
         custom_format['extra_message'] = str(extra_message)
-    h = fluent.handler.FluentHandler(tag, host=host, port=port)
+    if buffered:
+        h = BufferedFluentHandler(
+            tag, host, port, batch_size=batch_size,
+            flush_interval=flush_interval, spool_dir=spool_dir)
+    else:
+        h = fluent.handler.FluentHandler(tag, host=host, port=port)
     formatter = fluent.handler.FluentRecordFormatter(custom_format)
     h.setFormatter(formatter)
     h.setLevel(getattr(logging, log_level.upper()))
-    logger.addHandler(h)
+    _add_handler(logger, h, use_queue)
     return logger
 
 
 def add_sentry_handler(
-        logger, sentry_dsn, log_level='WARNING'):
+        logger, sentry_dsn, log_level='WARNING', use_queue=True):
     """Add a sentry-loghandler to logger.
 
     :param logger: the logger to add handler to
     :param sentry_dsn: Sentry server DSN, see in Project -> Settings
     :param log_level: DEBUG | INFO | WARNING | ERROR | CRITICAL
+    :param use_queue: add it behind the AsyncQueueHandler of logger if any
     """
+    import raven.handlers.logging
     h = raven.handlers.logging.SentryHandler(sentry_dsn)
     h.setLevel(getattr(logging, log_level.upper()))
-    logger.addHandler(h)
+    _add_handler(logger, h, use_queue)
     return logger
 
 
@@ -0,0 +1,99 @@
+#! /usr/bin/env python3
+
+"""
+Exponentially weighted rates of monotonic counters
+
+Used by sysinfo.SysMon for network interfaces.
+"""
+
+import math
+import time
+
+WRAP_32 = 1 << 32
+WRAP_64 = 1 << 64
+
+
+def counter_delta(last, value):
+    """Increase of a counter from last to value.
+
+    A decrease is taken as a wrap of a 32 bit counter if last fits in
+    32 bits, else of a 64 bit counter. If the wrapped increase would be
+    more than half of the counter range, the counter was reset (e.g. the
+    interface was recreated) and value is the increase."""
+    delta = value - last
+    if delta >= 0:
+        return delta
+    wrap = WRAP_32 if last < WRAP_32 else WRAP_64
+    delta += wrap
+    if delta > wrap >> 1:
+        return value
+    return delta
+
+
+class CounterRates(object):
+
+    """Rates per second of a set of counters, smoothed over several horizons.
+
+    Every update() computes the instantaneous rate since the previous one
+    and folds it into one EWMA per horizon, weighted by the real time
+    elapsed, so irregular sampling intervals are handled.
+
+    :param fields: counter names
+    :param horizons: time constants of the averages in seconds"""
+
+    def __init__(self, fields, horizons=(1, 10, 60)):
+        self.fields = tuple(fields)
+        self.horizons = tuple(horizons)
+        self._last = None
+        self._last_time = None
+        # horizon -> rates in the order of fields, None before 2nd update
+        self._rates = {h: None for h in self.horizons}
+
+    def update(self, counters, timestamp=None):
+        """Feed new counter values.
+
+        :param counters: a mapping containing every field
+        :param timestamp: time.monotonic() of the values, now if None"""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        values = [counters[k] for k in self.fields]
+        last, last_time = self._last, self._last_time
+        self._last, self._last_time = values, timestamp
+        if last is None:
+            return
+        elapsed = timestamp - last_time
+        if elapsed <= 0:
+            return
+
+        current = [counter_delta(a, b) / elapsed
+                   for a, b in zip(last, values)]
+        for h in self.horizons:
+            rates = self._rates[h]
+            if rates is None:
+                # start from the first measured rate rather than from 0
+                self._rates[h] = current
+                continue
+            alpha = 1 - math.exp(-elapsed / h)
+            self._rates[h] = [r + alpha * (c - r)
+                              for r, c in zip(rates, current)]
+
+    def rates(self, horizon):
+        """Smoothed rates of every field over horizon,
+        empty before the second update"""
+        rates = self._rates[horizon]
+        if rates is None:
+            return {}
+        return dict(zip(self.fields, rates))
+
+    def all_rates(self):
+        """Rates of every field and horizon, flat like
+        {'rx_bytes_10s': 1234.5, ...}, empty before the second update"""
+        result = {}
+        for h in self.horizons:
+            rates = self._rates[h]
+            if rates is None:
+                return {}
+            suffix = '_{:g}s'.format(h)
+            for k, r in zip(self.fields, rates):
+                result[k + suffix] = r
+        return result
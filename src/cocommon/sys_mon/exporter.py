@@ -0,0 +1,172 @@
+#! /usr/bin/env python3
+
+"""
+Serve SysMon output in OpenMetrics (Prometheus) text format
+
+Usage:
+    exporter = MetricsExporter(port=9101)
+    sys_mon.add_listener(exporter.update)
+    exporter.start()
+"""
+
+import re
+import logging
+import threading
+
+from collections.abc import Mapping
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# label name of the entities in 2 level sections of SysMon output
+ENTITY_LABELS = {
+    'cpu_core_info': 'cpu',
+    'disk_info': 'device',
+    'disk_io': 'device',
+    'network_info': 'interface',
+    'network_stats': 'interface',
+    'process_info': 'pid',
+    'pressure_info': 'resource',
+    'cgroup_io': 'device',
+    'cgroup_pressure': 'resource',
+}
+
+
+def _metric_name(*parts):
+    name = '_'.join(parts)
+    return re.sub(r'[^a-zA-Z0-9_:]', '_', name)
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n')
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def render_openmetrics(output, prefix='sysmon'):
+    """Render SysMon output as OpenMetrics text.
+
+    Every numeric field becomes a gauge named
+    <prefix>_<section without _info>_<field>, entities of 2 level sections
+    (cores, disks, interfaces, processes) become a label, e.g.
+    sysmon_network_rx{interface="eth0"} 12.5
+
+    Non numeric fields are skipped."""
+    lines = []
+    for section in sorted(output):
+        data = output[section]
+        if not isinstance(data, Mapping):
+            continue
+        family = section[:-5] if section.endswith('_info') else section
+
+        flat = [(k, v) for k, v in data.items() if _is_number(v)]
+        for field, value in sorted(flat):
+            name = _metric_name(prefix, family, field)
+            lines.append('# TYPE {} gauge'.format(name))
+            lines.append('{} {}'.format(name, value))
+
+        nested = [(k, v) for k, v in data.items()
+                  if isinstance(v, Mapping)]
+        if not nested:
+            continue
+        label = ENTITY_LABELS.get(section, 'name')
+        fields = sorted(set(f for _, v in nested for f in v))
+        for field in fields:
+            samples = [(entity, v[field]) for entity, v in nested
+                       if _is_number(v.get(field))]
+            if not samples:
+                continue
+            name = _metric_name(prefix, family, field)
+            lines.append('# TYPE {} gauge'.format(name))
+            for entity, value in samples:
+                lines.append('{}{{{}="{}"}} {}'.format(
+                    name, label, _label_value(entity), value))
+
+    lines.append('# EOF\n')
+    return '\n'.join(lines)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsExporter(object):
+
+    """HTTP server of the latest SysMon output.
+
+    The payload is rendered once in update(), usually called by SysMon
+    after every sample, a scrape only writes the prepared bytes.
+
+    :param host: address to listen on, all interfaces if ''
+    :param port: port to listen on
+    :param path: path of the metrics
+    :param prefix: prefix of metric names"""
+
+    def __init__(self, host='', port=9101, path='/metrics', prefix='sysmon'):
+        self._logger = logging.getLogger(__name__)
+        self._address = (host, port)
+        self._path = path
+        self._prefix = prefix
+        self._payload = b'# EOF\n'
+        self._server = None
+        self._thread = None
+
+    def update(self, output):
+        """Render output, replacing the payload served"""
+        self._payload = render_openmetrics(output, self._prefix).encode()
+
+    @property
+    def payload(self):
+        return self._payload
+
+    @property
+    def server_address(self):
+        """(host, port) actually listened on, port may be 0 before start"""
+        if self._server is None:
+            return self._address
+        return self._server.server_address
+
+    def _make_handler(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != exporter._path:
+                    self.send_error(404)
+                    return
+                payload = exporter._payload
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, fmt, *args):
+                exporter._logger.debug(fmt, *args)
+
+        return Handler
+
+    def start(self):
+        """Start serving in a daemon thread"""
+        self._server = _ThreadingHTTPServer(
+            self._address, self._make_handler())
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name='MetricsExporter')
+        self._thread.daemon = True
+        self._thread.start()
+        self._logger.info('Serving metrics at %s:%s%s',
+                          self.server_address[0], self.server_address[1],
+                          self._path)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            self._thread = None
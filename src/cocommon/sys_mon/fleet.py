@@ -0,0 +1,300 @@
+#! /usr/bin/env python3
+
+"""
+Sample many remote linux hosts concurrently
+
+Every host has a persistent SSH connection and its own SysMon, fed by
+one command per tick which dumps the /proc files, parsed by the same
+functions as local sampling. Snapshots have the same shape as the local
+SysMon ones, except processes, cgroup and disk usage from df.
+
+Usage:
+    sampler = FleetSampler(['web1', 'web2'], username='monitor',
+                           key_filename='~/.ssh/id_rsa')
+    while True:
+        snapshots = sampler.sample()  # {host: snapshot}
+        time.sleep(10)
+"""
+
+import time
+import logging
+import threading
+import subprocess
+import concurrent.futures
+
+from . import sysstat
+from .sysinfo import SysMon
+
+# files under /proc dumped on every tick, name -> path
+PROC_FILES = (
+    'uptime',
+    'stat',
+    'meminfo',
+    'diskstats',
+    'loadavg',
+    'net/dev',
+    'pressure/cpu',
+    'pressure/memory',
+    'pressure/io',
+)
+MARKER = b'@@@cocommon@@@'
+# seconds between checks for queued hosts starting in FleetSampler.sample
+POLL_INTERVAL = 0.05
+DF_NAME = 'df'
+
+
+def dump_command():
+    """Shell command printing every PROC_FILES and df -k,
+    each after a marker line with its name"""
+    parts = ['cd /proc']
+    for name in PROC_FILES:
+        parts.append('echo "{} {}"; cat {} 2>/dev/null'.format(
+            MARKER.decode(), name, name))
+    parts.append('echo "{} {}"; df -k 2>/dev/null'.format(
+        MARKER.decode(), DF_NAME))
+    return '; '.join(parts)
+
+
+def split_dump(data):
+    """Split output of dump_command (bytes) into {name: content}"""
+    files = {}
+    for part in data.split(MARKER + b' ')[1:]:
+        name, _, content = part.partition(b'\n')
+        files[name.decode().strip()] = content
+    return files
+
+
+class SSHConnection(object):
+
+    """A persistent paramiko connection to a host, reconnected on failure.
+
+    :param host: host name or address
+    :param timeout: seconds for connecting and for every command
+    other arguments are those of paramiko.SSHClient.connect"""
+
+    def __init__(self, host, username=None, password=None, port=22,
+                 key_filename=None, timeout=10):
+        self.host = host
+        self._username = username
+        self._password = password
+        self._port = port
+        self._key_filename = key_filename
+        self._timeout = timeout
+        self._client = None
+
+    def _connect(self):
+        import paramiko
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(self.host, self._port, self._username, self._password,
+                       key_filename=self._key_filename,
+                       timeout=self._timeout, banner_timeout=self._timeout,
+                       auth_timeout=self._timeout)
+        return client
+
+    def run(self, command):
+        """Run command, return its stdout in bytes"""
+        if self._client is None:
+            self._client = self._connect()
+        try:
+            _, stdout, _ = self._client.exec_command(
+                command, timeout=self._timeout)
+            return stdout.read()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+class LocalConnection(object):
+
+    """Runs commands on this host, same interface as SSHConnection.
+
+    For testing and for including the sampling host in a fleet."""
+
+    def __init__(self, host='localhost', timeout=10):
+        self.host = host
+        self._timeout = timeout
+
+    def run(self, command):
+        return subprocess.check_output(
+            command, shell=True, timeout=self._timeout, close_fds=True)
+
+    def close(self):
+        pass
+
+
+class RemoteStatReader(object):
+
+    """The read_* methods of sysstat.ProcStatReader,
+    on files dumped from a host by fetch()
+
+    :param connection: SSHConnection or alike"""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._command = dump_command()
+        self._files = {}
+        self.timestamp = None
+
+    def fetch(self):
+        """Dump all files from the host in one command.
+
+        self.timestamp is then the uptime of the host when dumped,
+        a monotonic clock free of the latency of the connection,
+        or the local time.monotonic() after the dump without uptime"""
+        self._files = split_dump(self._connection.run(self._command))
+        try:
+            self.timestamp = float(self._files['uptime'].split()[0])
+        except (KeyError, IndexError, ValueError):
+            self.timestamp = time.monotonic()
+
+    def read(self, name):
+        content = self._files.get(name)
+        if not content:
+            raise IOError('{} not read from {}'.format(
+                name, self._connection.host))
+        return content
+
+    def read_cpu_usage(self, per_core=False):
+        if per_core:
+            return sysstat.parse_cpu_stat(self.read('stat'))
+        return sysstat.parse_cpu_usage(self.read('stat'))
+
+    def read_mem_usage(self):
+        return sysstat.parse_meminfo(self.read('meminfo'))
+
+    def read_disk_usage(self):
+        return sysstat.parse_df(self.read(DF_NAME).decode(
+            'utf-8', 'replace'))
+
+    def read_disk_io(self, skip_idle=True):
+        return sysstat.parse_diskstats(self.read('diskstats'), skip_idle)
+
+    def read_loadavg(self):
+        return sysstat.parse_loadavg(self.read('loadavg'))
+
+    def read_pressure(self, resource):
+        return sysstat.parse_pressure(self.read('pressure/' + resource))
+
+    def read_network_usage(self):
+        return sysstat.parse_network_usage(self.read('net/dev'))
+
+    def read_network_usage_v2(self):
+        return sysstat.parse_network_usage_v2(self.read('net/dev'))
+
+    def read_network_counters(self):
+        return sysstat.parse_network_counters(self.read('net/dev'))
+
+    def close(self):
+        self._connection.close()
+
+
+class FleetSampler(object):
+
+    """Sample many hosts concurrently over pooled connections.
+
+    :param hosts: host names
+    :param max_workers: max number of hosts sampled at the same time
+    :param timeout: seconds to wait for a host in sample(), from when
+        its sampling starts
+    :param connect: callable(host) returning a connection,
+        an SSHConnection with the other keyword arguments if None
+    :param sys_mon_kwargs: extra arguments of the SysMon of every host,
+        like history or network_horizons
+    other keyword arguments are passed to SSHConnection"""
+
+    def __init__(self, hosts, max_workers=16, timeout=10, connect=None,
+                 sys_mon_kwargs=None, **ssh_kwargs):
+        self._logger = logging.getLogger(__name__)
+        self._hosts = list(hosts)
+        self._timeout = timeout
+        if connect is None:
+            def connect(host):
+                return SSHConnection(host, timeout=timeout, **ssh_kwargs)
+        self._connect = connect
+        self._sys_mon_kwargs = sys_mon_kwargs or {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self._readers = {}  # host -> RemoteStatReader
+        self._sys_mons = {}  # host -> SysMon
+        self._pending = {}  # host -> future not finished in time
+        self._lock = threading.Lock()
+
+    def _sample_host(self, host, started):
+        # the timeout of a host starts here, not while queued in the pool
+        started[host] = time.monotonic()
+        with self._lock:
+            reader = self._readers.get(host)
+            if reader is None:
+                reader = self._readers[host] = RemoteStatReader(
+                    self._connect(host))
+                kwargs = dict(log_interval=None, cgroup_root=None)
+                kwargs.update(self._sys_mon_kwargs)
+                self._sys_mons[host] = SysMon(reader=reader, **kwargs)
+            sys_mon = self._sys_mons[host]
+        reader.fetch()
+        return sys_mon.get_sys_info(reader.timestamp)
+
+    def sample(self):
+        """Sample every host once.
+
+        return a dictionary by host of SysMon snapshots, or of
+        {'error': message} for hosts which failed or did not answer in
+        timeout seconds after their sampling started, time waiting for a
+        free worker does not count. A host still busy with a previous
+        sample is not sampled again until it is done."""
+        started = {}  # host -> time.monotonic() when its worker began
+        futures = {}
+        result = {}
+        for host in self._hosts:
+            pending = self._pending.get(host)
+            if pending is not None and not pending.done():
+                result[host] = {'error': 'busy with previous sample'}
+                continue
+            self._pending.pop(host, None)
+            futures[host] = self._executor.submit(
+                self._sample_host, host, started)
+
+        while futures:
+            now = time.monotonic()
+            deadlines = []
+            for host, future in list(futures.items()):
+                if future.done():
+                    del futures[host]
+                    try:
+                        result[host] = future.result()
+                    except Exception as e:
+                        self._logger.warning(
+                            'Sampling %s failed: %r', host, e)
+                        result[host] = {'error': repr(e)}
+                elif host in started:
+                    deadline = started[host] + self._timeout
+                    if deadline <= now:
+                        del futures[host]
+                        self._pending[host] = future
+                        result[host] = {'error': 'timeout'}
+                    else:
+                        deadlines.append(deadline)
+            if futures:
+                # wake up for the first deadline, or soon to catch
+                # queued hosts starting
+                wait = min(deadlines) - now if deadlines else None
+                if len(deadlines) < len(futures):
+                    wait = POLL_INTERVAL if wait is None \
+                        else min(wait, POLL_INTERVAL)
+                concurrent.futures.wait(
+                    futures.values(), wait,
+                    concurrent.futures.FIRST_COMPLETED)
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            for reader in self._readers.values():
+                reader.close()
+            self._readers = {}
+            self._sys_mons = {}
@@ -0,0 +1,246 @@
+#! /usr/bin/env python3
+
+"""
+Fixed size ring file of SysMon samples
+
+One fixed width binary record per tick, written through mmap,
+so that history survives restarts and crashes of the monitored process,
+and other processes can read it without any parsing.
+
+File layout (little endian):
+    header: magic, layout version, header size, record size, capacity,
+            number of fields, padding, count of records ever written
+            (8-byte aligned, readers rely on it being updated at once),
+            length of field names, field names joined by '\\n'
+    records: capacity slots of (timestamp, value of every field) doubles,
+             record i is in slot i % capacity, the oldest slot is the
+             next one written so only capacity - 1 records are readable
+"""
+
+import os
+import math
+import mmap
+import time
+import struct
+import logging
+
+from collections.abc import Mapping
+
+MAGIC = b'SYSMONH1'
+LAYOUT_VERSION = 2
+# magic, layout version, header size, record size, capacity, n_fields,
+# padding, count, padded so that count is at offset 32, 8-byte aligned
+HEADER = struct.Struct('<8sIIIII4xQ')
+COUNT_OFFSET = HEADER.size - 8
+NAMES_OFFSET = HEADER.size + 4  # after the length of names
+# sections left out of the default fields, tens of fields per interface
+# or core would make records of KBs
+COMPACT_SKIP = ('process_info', 'network_stats', 'cpu_core_info')
+
+
+def flatten(snapshot, skip=('process_info',)):
+    """Flatten numeric fields of a SysMon snapshot,
+    like {'cpu_info.usr': 1.0, 'network_info.eth0.rx': 12.5}
+
+    :param skip: sections to leave out, processes come and go"""
+    result = {}
+
+    def walk(prefix, data):
+        for k, v in data.items():
+            name = '{}.{}'.format(prefix, k)
+            if isinstance(v, Mapping):
+                walk(name, v)
+            elif isinstance(v, (int, float)) and not isinstance(v, bool):
+                result[name] = v
+
+    for section, data in snapshot.items():
+        if section not in skip and isinstance(data, Mapping):
+            walk(section, data)
+    return result
+
+
+def _layout(fields):
+    names = '\n'.join(fields).encode('utf-8')
+    header_size = NAMES_OFFSET + len(names)
+    # align records to pages
+    header_size = (header_size + mmap.PAGESIZE - 1) // mmap.PAGESIZE \
+        * mmap.PAGESIZE
+    record = struct.Struct('<{}d'.format(len(fields) + 1))
+    return names, header_size, record
+
+
+class HistoryFile(object):
+
+    """A ring file of samples, opened for writing or read only.
+
+    For writing, an existing file with the same fields and capacity is
+    reopened and appended to, anything else at path is renamed to
+    <path>.<YYYYmmdd-HHMMSS of its last change> and kept.
+
+    :param path: file path
+    :param fields: field names, required for writing,
+        read from the file if read only
+    :param capacity: number of slots, at least 2, one more than the
+        records kept, required for writing
+    :param readonly: open an existing file for queries only"""
+
+    def __init__(self, path, fields=None, capacity=None, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        if readonly:
+            self._open_readonly()
+        else:
+            if fields is None or not capacity:
+                raise ValueError('fields and capacity are required to write')
+            if capacity < 2:
+                raise ValueError('capacity must be at least 2')
+            self._open_writable(list(fields), capacity)
+        self._index = {k: i + 1 for i, k in enumerate(self.fields)}
+
+    def _map_header(self, mm):
+        magic, version, header_size, record_size, capacity, n_fields, _ = \
+            HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            raise ValueError('Not a history file: {}'.format(self.path))
+        names_len = struct.unpack_from('<I', mm, HEADER.size)[0]
+        names = mm[NAMES_OFFSET:NAMES_OFFSET + names_len].decode('utf-8')
+        fields = names.split('\n') if names else []
+        if len(fields) != n_fields:
+            raise ValueError('Corrupt history file: {}'.format(self.path))
+        return fields, header_size, record_size, capacity
+
+    def _open_readonly(self):
+        with open(self.path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.fields, self._header_size, _, self.capacity = \
+            self._map_header(self._mm)
+        self._record = _layout(self.fields)[2]
+
+    def _open_writable(self, fields, capacity):
+        names, header_size, record = _layout(fields)
+        size = header_size + record.size * capacity
+        if os.path.isfile(self.path) and os.path.getsize(self.path) == size:
+            with open(self.path, 'r+b') as f:
+                mm = mmap.mmap(f.fileno(), size)
+            try:
+                if self._map_header(mm) == (
+                        fields, header_size, record.size, capacity):
+                    self._set_layout(mm, fields, header_size, record,
+                                     capacity)
+                    return
+            except ValueError:
+                pass
+            mm.close()
+
+        if os.path.exists(self.path):
+            # another layout, e.g. interfaces changed across a restart:
+            # keep the old history for post-mortems
+            old_path = '{}.{}'.format(self.path, time.strftime(
+                '%Y%m%d-%H%M%S',
+                time.localtime(os.path.getmtime(self.path))))
+            n = 0
+            while os.path.exists(old_path if not n
+                                 else '{}.{}'.format(old_path, n)):
+                n += 1
+            if n:
+                old_path = '{}.{}'.format(old_path, n)
+            os.rename(self.path, old_path)
+            logging.getLogger(__name__).warning(
+                'History file %s has another layout, moved to %s',
+                self.path, old_path)
+
+        # start over in a new file, readers of the old one keep a valid
+        # mapping
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w+b') as f:
+            f.truncate(size)
+            mm = mmap.mmap(f.fileno(), size)
+        HEADER.pack_into(mm, 0, MAGIC, LAYOUT_VERSION, header_size,
+                         record.size, capacity, len(fields), 0)
+        struct.pack_into('<I', mm, HEADER.size, len(names))
+        mm[NAMES_OFFSET:NAMES_OFFSET + len(names)] = names
+        os.rename(tmp_path, self.path)
+        self._set_layout(mm, fields, header_size, record, capacity)
+
+    def _set_layout(self, mm, fields, header_size, record, capacity):
+        self._mm = mm
+        self.fields = fields
+        self._header_size = header_size
+        self._record = record
+        self.capacity = capacity
+
+    @property
+    def count(self):
+        """Number of records ever written"""
+        return struct.unpack_from('<Q', self._mm, COUNT_OFFSET)[0]
+
+    def __len__(self):
+        """Number of readable records"""
+        return min(self.count, self.capacity - 1)
+
+    def append(self, timestamp, values):
+        """Write a record, overwriting the oldest one if full.
+
+        :param timestamp: time.time() of the sample
+        :param values: a mapping of field values, missing ones are NaN"""
+        count = self.count
+        nan = float('nan')
+        self._record.pack_into(
+            self._mm,
+            self._header_size + count % self.capacity * self._record.size,
+            timestamp, *[values.get(k, nan) for k in self.fields])
+        # publish the record only once it is written
+        struct.pack_into('<Q', self._mm, COUNT_OFFSET, count + 1)
+
+    def _offset(self, i):
+        """Offset of the i-th record ever written"""
+        return self._header_size + i % self.capacity * self._record.size
+
+    def _bisect(self, lo, hi, timestamp, right):
+        """First record index in [lo, hi) with a timestamp > (right)
+        or >= (not right) timestamp, reading only timestamps"""
+        while lo < hi:
+            mid = (lo + hi) // 2
+            t = struct.unpack_from('<d', self._mm, self._offset(mid))[0]
+            if t < timestamp or (right and t == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, start=None, end=None):
+        """Records with start <= timestamp <= end, oldest first.
+
+        Only the records returned are unpacked, they are found by binary
+        search, assuming timestamps increase (the wall clock is not set
+        backwards).
+        Return a list of tuples (timestamp, value of every field in the
+        order of self.fields)."""
+        count = self.count
+        # the oldest slot is the next one written, maybe being written
+        first = max(0, count - self.capacity + 1)
+        lo = first if start is None else \
+            self._bisect(first, count, start, False)
+        hi = count if end is None else self._bisect(lo, count, end, True)
+        records = [self._record.unpack_from(self._mm, self._offset(i))
+                   for i in range(lo, hi)]
+        # the writer may have gone on meanwhile,
+        # overwritten records may be torn
+        overwritten = self.count - self.capacity + 1 - lo
+        if overwritten > 0:
+            records = records[overwritten:]
+        return records
+
+    def column(self, field, start=None, end=None):
+        """[(timestamp, value)] of a field, NaN values left out"""
+        i = self._index[field]
+        return [(r[0], r[i]) for r in self.query(start, end)
+                if not math.isnan(r[i])]
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
@@ -0,0 +1,183 @@
+#! /usr/bin/env python3
+
+"""
+Collect resource usage of a set of processes
+Can only be used on linux
+"""
+
+import os
+import re
+import time
+
+from .sysstat import ProcReader
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def parse_proc_pid_stat(data):
+    """Parse content of /proc/[pid]/stat (bytes).
+
+    return (comm, state, utime + stime in ticks, num_threads, starttime)"""
+
+    # Example:
+    # 1234 (python3 -u) S 1 1234 1234 0 -1 4194560 ... 20 0 3 0 2706 ...
+    # comm may contain spaces and parentheses, so split on the last ')'
+    head, tail = data.rsplit(b')', 1)
+    comm = head.split(b'(', 1)[1].decode('utf-8', 'replace')
+    values = tail.split()
+    # values[0] is field 3 (state) of proc(5)
+    return (comm, values[0].decode(), int(values[11]) + int(values[12]),
+            int(values[17]), int(values[19]))
+
+
+def parse_proc_pid_io(data):
+    """Parse content of /proc/[pid]/io (bytes), return (read, write) bytes
+    actually fetched from / sent to the storage layer"""
+    read_bytes = write_bytes = 0
+    for line in data.splitlines():
+        if line.startswith(b'read_bytes:'):
+            read_bytes = int(line[11:])
+        elif line.startswith(b'write_bytes:'):
+            write_bytes = int(line[12:])
+    return read_bytes, write_bytes
+
+
+class _Process(object):
+
+    """Open /proc files and last counters of one sampled process"""
+
+    def __init__(self, proc_root, pid):
+        pid_dir = os.path.join(proc_root, str(pid))
+        self.fd_dir = os.path.join(pid_dir, 'fd')
+        self.stat = ProcReader(os.path.join(pid_dir, 'stat'), 1024)
+        self.statm = ProcReader(os.path.join(pid_dir, 'statm'), 256)
+        try:
+            self.io = ProcReader(os.path.join(pid_dir, 'io'), 256)
+        except OSError:
+            # not readable for processes of other users
+            self.io = None
+        self.starttime = None
+        self.last = None  # (timestamp, cpu ticks, read bytes, write bytes)
+
+    def close(self):
+        self.stat.close()
+        self.statm.close()
+        if self.io is not None:
+            self.io.close()
+
+
+class ProcessSampler(object):
+
+    """Sample CPU, memory, I/O and fd usage of many processes in one pass.
+
+    Processes are either given by pid, or found by a name pattern among
+    all processes on every call of sample(), so new workers are picked up
+    and dead ones dropped. /proc files of sampled processes stay open
+    between calls.
+
+    :param pids: iterable of pids to sample
+    :param pattern: regular expression searched in process names,
+        used only if pids is None
+    :param match_cmdline: search pattern in the full command line rather
+        than in the (at most 15 characters) process name
+    :param proc_root: mount point of procfs, changed for test fixtures"""
+
+    def __init__(self, pids=None, pattern=None, match_cmdline=False,
+                 proc_root='/proc'):
+        if pids is None and pattern is None:
+            raise ValueError('Either pids or pattern is required')
+        self._pids = None if pids is None else set(pids)
+        self._pattern = None if pattern is None else re.compile(pattern)
+        self._match_cmdline = match_cmdline
+        self._proc_root = proc_root
+        self._processes = {}  # pid -> _Process
+        self._matches = {}  # pid -> bool, result of pattern matching
+
+    def _matched(self, pid):
+        name = 'cmdline' if self._match_cmdline else 'comm'
+        try:
+            with open(os.path.join(
+                    self._proc_root, str(pid), name), 'rb') as f:
+                name = f.read().replace(b'\0', b' ').strip()
+        except OSError:
+            return False
+        return self._pattern.search(name.decode('utf-8', 'replace')) \
+            is not None
+
+    def _find_pids(self):
+        """pids to sample in this round"""
+        if self._pids is not None:
+            return self._pids
+        pids = set(int(i) for i in os.listdir(self._proc_root)
+                   if i.isdigit())
+        # forget exited processes, so that a reused pid is checked again
+        self._matches = {k: v for k, v in self._matches.items()
+                         if k in pids}
+        for pid in pids:
+            if pid not in self._matches:
+                self._matches[pid] = self._matched(pid)
+        return set(k for k, v in self._matches.items() if v)
+
+    def _sample_one(self, pid, now):
+        proc = self._processes.get(pid)
+        if proc is None:
+            proc = self._processes[pid] = _Process(self._proc_root, pid)
+        name, state, ticks, threads, starttime = parse_proc_pid_stat(
+            proc.stat.read())
+        if starttime != proc.starttime:
+            # first sample of this process
+            proc.starttime = starttime
+            proc.last = None
+        rss = int(proc.statm.read().split()[1]) * PAGE_SIZE >> 10  # KB
+        read_bytes = write_bytes = None
+        if proc.io is not None:
+            read_bytes, write_bytes = parse_proc_pid_io(proc.io.read())
+        try:
+            fds = len(os.listdir(proc.fd_dir))
+        except PermissionError:
+            fds = None
+
+        info = {
+            'name': name,
+            'state': state,
+            'threads': threads,
+            'rss': rss,
+            'fds': fds,
+        }
+        if proc.last is not None:
+            last_time, last_ticks, last_read, last_write = proc.last
+            elapsed = now - last_time
+            if elapsed > 0:
+                info['cpu'] = round(
+                    (ticks - last_ticks) * 100.0 / CLK_TCK / elapsed, 2)
+                if read_bytes is not None:
+                    info['read_kb'] = (read_bytes - last_read) / 1024.0 \
+                        / elapsed
+                    info['write_kb'] = (write_bytes - last_write) / 1024.0 \
+                        / elapsed
+        proc.last = (now, ticks, read_bytes, write_bytes)
+        return info
+
+    def sample(self):
+        """Sample all processes.
+
+        return a dictionary by pid, cpu (percent of one core)
+        and I/O rates (KB/s) are only available from the second sample
+        of a process on, rss is in KB"""
+        now = time.monotonic()
+        result = {}
+        for pid in self._find_pids():
+            try:
+                result[pid] = self._sample_one(pid, now)
+            except (OSError, ValueError, IndexError):
+                # exited, or exited and pid reused between reads
+                pass
+        for pid in [i for i in self._processes if i not in result]:
+            self._processes.pop(pid).close()
+        return result
+
+    def close(self):
+        for proc in self._processes.values():
+            proc.close()
+        self._processes = {}
@@ -0,0 +1,138 @@
+#! /usr/bin/env python3
+
+"""
+Fixed capacity sample history used by sysinfo.SysMon
+
+Every metric has its own preallocated array column,
+so appending a sample never allocates.
+"""
+
+import time
+from array import array
+
+
+class RingBuffer(object):
+
+    """A ring of the last `capacity` samples of a fixed set of metrics.
+
+    Running sums are kept so that mean() is O(1) in the window length,
+    delta(), rate() and per_second() only look at the oldest and newest
+    samples. Every sample has a time.monotonic() timestamp.
+
+    :param fields: metric names, one column for each
+    :param capacity: max number of samples kept"""
+
+    def __init__(self, fields, capacity):
+        if capacity < 1:
+            raise ValueError('capacity must be positive: {}'.format(capacity))
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self._columns = [array('d', [0.0]) * capacity for _ in self.fields]
+        self._times = array('d', [0.0]) * capacity
+        self._sums = [0.0] * len(self.fields)
+        self._pos = 0  # slot for next sample
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, sample, timestamp=None):
+        """Append a sample, dropping the oldest one if full.
+
+        :param sample: a mapping containing every field
+        :param timestamp: time.monotonic() when sample was taken,
+            now if None"""
+        pos = self._pos
+        self._times[pos] = time.monotonic() if timestamp is None \
+            else timestamp
+        full = self._len == self.capacity
+        sums = self._sums
+        for i, key in enumerate(self.fields):
+            col = self._columns[i]
+            value = sample[key]
+            if full:
+                sums[i] += value - col[pos]
+            else:
+                sums[i] += value
+            col[pos] = value
+
+        pos += 1
+        if pos == self.capacity:
+            pos = 0
+            # resync running sums to stop floating point drift,
+            # amortized O(1) per sample
+            self._sums = [sum(col) for col in self._columns]
+        self._pos = pos
+        if not full:
+            self._len += 1
+
+    def _index(self, i):
+        """Slot of the i-th sample, 0 is the oldest, -1 the newest"""
+        if i < 0:
+            i += self._len
+        return (self._pos - self._len + i) % self.capacity
+
+    def last(self):
+        """The newest sample as a dict, empty if no samples"""
+        if not self._len:
+            return {}
+        idx = self._index(-1)
+        return {k: col[idx] for k, col in zip(self.fields, self._columns)}
+
+    def mean(self):
+        """Average of every field over the window, empty if no samples"""
+        if not self._len:
+            return {}
+        n = self._len
+        return {k: s / n for k, s in zip(self.fields, self._sums)}
+
+    def delta(self):
+        """Newest minus oldest sample for every field"""
+        if self._len < 2:
+            return {}
+        first = self._index(0)
+        last = self._index(-1)
+        return {k: col[last] - col[first]
+                for k, col in zip(self.fields, self._columns)}
+
+    def rate(self, div_factor=1):
+        """Average increase per sample of counters, divided by div_factor.
+
+        Same as sysinfo.get_avg_by_sum on a list of the samples."""
+        if self._len < 2:
+            return {}
+        div_factor *= self._len - 1
+        return {k: v / div_factor for k, v in self.delta().items()}
+
+    def elapsed(self):
+        """Seconds between the oldest and newest samples"""
+        if self._len < 2:
+            return 0.0
+        return self._times[self._index(-1)] - self._times[self._index(0)]
+
+    def per_second(self):
+        """Increase per second of counters over the window,
+        using the real time elapsed between samples"""
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return {}
+        return {k: v / elapsed for k, v in self.delta().items()}
+
+    def column(self, field):
+        """Values of a field in the window, from oldest to newest"""
+        col = self._columns[self.fields.index(field)]
+        start = self._index(0)
+        end = start + self._len
+        if end <= self.capacity:
+            return col[start:end].tolist()
+        return col[start:].tolist() + col[:end - self.capacity].tolist()
+
+    def percentile(self, q):
+        """q-th percentile (0 - 100) of every field over the window.
+
+        Nearest rank, empty if no samples"""
+        if not self._len:
+            return {}
+        rank = min(self._len - 1, max(0, int(round(
+            q / 100.0 * (self._len - 1)))))
+        return {k: sorted(self.column(k))[rank] for k in self.fields}
@@ -6,13 +6,22 @@ Collect machine status
 Can only be used on linux
 """
 
+import asyncio
 import logging
 import logging.handlers
 import time
 import pprint
+import threading
 import traceback
+import types
 
 from . import sysstat
+from . import history
+from .ringbuf import RingBuffer
+from .ewma import CounterRates
+
+# shared by all SysMon instances
+_interface_table = sysstat.InterfaceTable()
 
 
 def get_avg_by_sum(buf, div_factor=1):
@@ -43,26 +52,155 @@ def get_avg(buf):
     return avg
 
 
+def get_disk_io_rates(buf):
+    """I/O rates of a disk from a RingBuffer of read_disk_io samples.
+
+    Like iostat -x: IOPS, KB/s, average await in ms,
+    average queue depth and utilization in percent"""
+    secs = buf.elapsed()
+    if secs <= 0:
+        return {}
+    d = buf.delta()
+    ms = secs * 1000
+    ios = d['reads'] + d['writes']
+    return {
+        'reads': d['reads'] / secs,
+        'writes': d['writes'] / secs,
+        'read_kb': d['read_sectors'] / 2 / secs,
+        'write_kb': d['write_sectors'] / 2 / secs,
+        'r_await': d['read_ms'] / d['reads'] if d['reads'] else 0.0,
+        'w_await': d['write_ms'] / d['writes'] if d['writes'] else 0.0,
+        'await': (d['read_ms'] + d['write_ms']) / ios if ios else 0.0,
+        'queue_depth': d['weighted_io_ms'] / ms,
+        'util': min(100.0, d['io_ms'] * 100 / ms),
+        'in_progress': buf.last()['in_progress'],
+    }
+
+
 def get_percent(adict):
     s = sum(adict.values())
+    if not s:
+        return {k: 0.0 for k in adict}
     return {k: round(adict[k] * 100.0 / s, 2) for k in adict}
 
 
+def _freeze(adict):
+    """A read-only copy of adict and of the dicts nested in it"""
+    return types.MappingProxyType(
+        {k: _freeze(v) if isinstance(v, dict) else v
+         for k, v in adict.items()})
+
+
+def _thaw(mapping):
+    """A dict copy of a mapping made by _freeze"""
+    return {k: _thaw(v) if isinstance(v, types.MappingProxyType) else v
+            for k, v in mapping.items()}
+
+
+class _PrettyFormat(object):
+
+    """Defer pprint.pformat until the log record is actually emitted"""
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return pprint.pformat(_thaw(self.obj))
+
+
+def pick(adict, keys):
+    """Sub-dict of adict with only keys"""
+    return {k: adict[k] for k in keys}
+
+
 class SysMon(object):
 
     """A system info monitor.
 
-    :param output: a dictionary for output as this module
-        usually runs in a stand alone thread"""
-
-    def __init__(self, output, update_interval=1):
+    Every get_sys_info publishes a new read-only snapshot, replacing the
+    previous one by a single reference swap, so readers in other threads
+    always see a complete sample without locking, see snapshot() and
+    wait_for_snapshot(). Snapshots are never modified once published,
+    their sections are read-only mappings too.
+
+    :param output: if not None, a dictionary also updated with every
+        snapshot, for compatibility. Its sections are plain dicts of its
+        own, the caller may change them
+    :param update_interval: seconds between two samples
+    :param history: number of samples to keep by metric family,
+        overrides DEFAULT_HISTORY, e.g. {'disk_io': 60}, network rates
+        are set by network_horizons
+    :param network_horizons: horizons in seconds of the network rates in
+        output['network_stats'], the one closest to 15 seconds (the
+        former fixed window) is used for output['network_info']
+    :param process_sampler: a procstat.ProcessSampler, if given, usage of
+        its processes is in output['process_info']
+    :param log_interval: min seconds between two INFO logs of the snapshot,
+        None to never log it
+    :param proc_root: mount point of procfs, changed for test fixtures
+    :param cgroup_root: mount point of cgroup v2. If this process is in a
+        non-root cgroup, e.g. a container, its usage and limits are in
+        output['cgroup_info'], ['cgroup_io'] and ['cgroup_pressure'].
+        None to skip cgroup metrics
+    :param reader: object with the read_* methods of
+        sysstat.ProcStatReader to sample from, e.g. fleet.RemoteStatReader,
+        a ProcStatReader of proc_root if None
+    :param history_file: if not None, path of a history.HistoryFile,
+        every snapshot is appended to it
+    :param history_capacity: number of records in history_file
+    :param history_fields: flattened fields to record, like 'cpu_info.usr'
+        see history.flatten, if None those of the second snapshot (the
+        first one with rates) but history.COMPACT_SKIP sections:
+        processes, per core CPU and network_stats"""
+
+    DEFAULT_HISTORY = {
+        'cpu': 15,
+        'sched': 15,
+        'mem': 1,
+        'disk': 1,
+        'disk_io': 15,
+        'cgroup': 15,
+    }
+
+    def __init__(self, output=None, update_interval=1, history=None,
+                 network_horizons=(1, 10, 60), process_sampler=None,
+                 log_interval=60, proc_root='/proc',
+                 cgroup_root='/sys/fs/cgroup', history_file=None,
+                 history_capacity=86400, history_fields=None, reader=None):
         """argument output is the place for output"""
         self._logger = logging.getLogger(__name__)
-        self._cpu_data = []
-        self._mem_data = []
-        self._disk_data = {}  # multiple disks
-        self._network_data = {}  # multiple interfaces
+        self._history = dict(self.DEFAULT_HISTORY)
+        if history:
+            unknown = set(history) - set(self._history)
+            if unknown:
+                raise ValueError('Unknown history families: {}'.format(
+                    ', '.join(sorted(unknown))))
+            self._history.update(history)
+        # family -> key (e.g. cpu0, eth0, /dev/sda1) -> RingBuffer
+        self._buffers = {k: {} for k in self._history}
         self._update_interval = update_interval
+        self._network_horizons = tuple(network_horizons)
+        self._network_info_horizon = min(
+            self._network_horizons, key=lambda h: abs(h - 15))
+        self._network_rates = {}  # interface -> CounterRates
+        self._reader = sysstat.ProcStatReader(proc_root) if reader is None \
+            else reader
+        cgroup_path = None if cgroup_root is None \
+            else sysstat.find_cgroup(proc_root, cgroup_root)
+        self._cgroup = None if cgroup_path is None \
+            else sysstat.CgroupReader(cgroup_path)
+        self._pressure_resources = None  # supported ones, found on 1st tick
+        self._process_sampler = process_sampler
+        self._listeners = []
+        self._history_file = None
+        self._history_path = history_file
+        self._history_capacity = history_capacity
+        self._history_fields = history_fields
+        self._log_interval = log_interval
+        self._last_log_time = None
+        # (version, snapshot), replaced as a whole
+        self._published = (0, types.MappingProxyType({}))
+        self._published_cond = threading.Condition()
         self.output = output
 
     @staticmethod
@@ -71,59 +209,348 @@ class SysMon(object):
             buf.pop(0)
         buf.append(new_data)
 
+    def refresh_history(self, family, key, sample, fields=None,
+                        timestamp=None):
+        """Append sample to the ring buffer of (family, key).
+
+        The buffer is created on first use with the history length
+        of the family.
+
+        :param fields: fields to keep, all keys of sample if None
+        :param timestamp: time.monotonic() of the sample, now if None"""
+        buffers = self._buffers[family]
+        buf = buffers.get(key)
+        if buf is None:
+            buf = buffers[key] = RingBuffer(
+                sample if fields is None else fields, self._history[family])
+        buf.append(sample, timestamp)
+        return buf
+
+    def prune_history(self, family, keys):
+        """Drop buffers of a family whose key is not in keys any more,
+        e.g. removed interfaces or unmounted disks"""
+        buffers = self._buffers[family]
+        for k in [k for k in buffers if k not in keys]:
+            del buffers[k]
+
+    def get_history(self, family, key):
+        """The RingBuffer of (family, key) or None,
+        e.g. get_history('disk_io', 'sda').percentile(99)"""
+        return self._buffers.get(family, {}).get(key)
+
+    def add_listener(self, callback):
+        """Call callback(snapshot) after every get_sys_info,
+        e.g. exporter.MetricsExporter.update"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def snapshot(self):
+        """The latest snapshot, a read-only mapping, empty before the
+        first sample"""
+        return self._published[1]
+
+    @property
+    def version(self):
+        """Number of snapshots published so far"""
+        return self._published[0]
+
+    def wait_for_snapshot(self, after_version=None, timeout=None):
+        """Wait for a snapshot newer than after_version.
+
+        :param after_version: a version from a previous call,
+            the current version if None, i.e. wait for the next one
+        :param timeout: seconds to wait at most, forever if None
+        :return: (version, snapshot), or None if timed out"""
+        if after_version is None:
+            after_version = self._published[0]
+        with self._published_cond:
+            if not self._published_cond.wait_for(
+                    lambda: self._published[0] > after_version, timeout):
+                return None
+            return self._published
+
+    def _publish(self, snapshot):
+        # a frozen copy, output keeps the dicts as built, so changing
+        # them never changes what was published
+        frozen = _freeze(snapshot)
+        with self._published_cond:
+            # readers never take the lock, it is only for waiters
+            self._published = (self._published[0] + 1, frozen)
+            self._published_cond.notify_all()
+        if self.output is not None:
+            self.output.update(snapshot)
+        return frozen
+
+    def _record_history(self, snapshot):
+        values = history.flatten(
+            snapshot, history.COMPACT_SKIP if self._history_fields is None
+            else ('process_info',))
+        if self._history_file is None:
+            if self._history_fields is None and self.version < 2:
+                # rates are empty in the first snapshot
+                return
+            self._history_file = history.HistoryFile(
+                self._history_path,
+                self._history_fields or sorted(values),
+                self._history_capacity)
+        self._history_file.append(time.time(), values)
+
+    def _log_snapshot(self, snapshot, now):
+        if self._log_interval is None or \
+                not self._logger.isEnabledFor(logging.INFO):
+            return
+        if self._last_log_time is not None and \
+                now - self._last_log_time < self._log_interval:
+            return
+        self._last_log_time = now
+        self._logger.info('%s', _PrettyFormat(snapshot))
+
     @staticmethod
     def get_ip_address(ifname):
         """Get ip address by interface name
 
+        Looked up in a table of all interfaces, refreshed every minute.
+        Return None if the interface does not exist or has no IPv4 address.
+
         :param ifname: interface name"""
-        return sysstat.get_ip_address(ifname)
+        return _interface_table.get_ip_address(ifname)
 
-    def get_sys_info(self):
+    def get_sys_info(self, now=None):
         """Get system infomation.
 
-        Consists of CPU, Memory,
-        Disk (every disk), Network (every interface)"""
-
-        self.refresh_stat_buffer(self._cpu_data, 15, sysstat.read_cpu_usage())
-
-        self.refresh_stat_buffer(self._mem_data, 1, sysstat.read_mem_usage())
-
-        disk_usage = sysstat.read_disk_usage()
-        for k, v in disk_usage.items():
-            if k not in self._disk_data:
-                self._disk_data[k] = []
-            self.refresh_stat_buffer(self._disk_data[k], 1, v)
-
-        network_usage = sysstat.read_network_usage_v2()
-        for k, v in network_usage.items():
-            if k not in self._network_data:
-                self._network_data[k] = []
-            self.refresh_stat_buffer(self._network_data[k], 15, v)
-
-        self.output.update({'cpu_info': get_percent(
-            get_avg_by_sum(self._cpu_data, self._update_interval)),
-            'mem_info': get_avg(self._mem_data),
-            'disk_info': {k: get_avg(v)
-                          for k, v in self._disk_data.items()},
-            'network_info': {k: get_avg_by_sum(
-                             v, self._update_interval)
-                             for k, v in self._network_data.items()},
-        })
+        Consists of CPU (overall and every core), scheduler counters,
+        load average, pressure stall, Memory, Disk usage and I/O (every disk),
+        Network (every interface, every counter),
+        the cgroup of this process if in a container,
+        and the sampled processes if any.
+        Return the new snapshot.
+
+        :param now: monotonic time the data was read at, e.g. the uptime
+            of a remote host when dumped, time.monotonic() if None"""
+
+        # rates are per second of real time between samples,
+        # whatever the scheduling delay was
+        if now is None:
+            now = time.monotonic()
+
+        cpu_stat = self._reader.read_cpu_usage(per_core=True)
+        cpu_info = get_percent(self.refresh_history(
+            'cpu', 'cpu', cpu_stat['cpu'],
+            sysstat.CPU_BASE_FIELDS, now).delta())
+        cpu_core_info = {k: get_percent(self.refresh_history(
+            'cpu', k, v, sysstat.CPU_BASE_FIELDS, now).delta())
+            for k, v in cpu_stat['cores'].items()}
+        sched_info = self.refresh_history(
+            'sched', 'sched', cpu_stat, sysstat.SCHED_FIELDS,
+            now).per_second()
+        # these two are gauges rather than counters
+        sched_info['procs_running'] = cpu_stat['procs_running']
+        sched_info['procs_blocked'] = cpu_stat['procs_blocked']
+
+        mem_info = self.refresh_history(
+            'mem', 'mem', self._reader.read_mem_usage(),
+            timestamp=now).mean()
+
+        disk_usage = self._reader.read_disk_usage()
+        self.prune_history('disk', disk_usage)
+        disk_info = {k: self.refresh_history(
+                     'disk', k, v, timestamp=now).mean()
+                     for k, v in disk_usage.items()}
+
+        disk_io = self._reader.read_disk_io()
+        self.prune_history('disk_io', disk_io)
+        disk_io_info = {k: get_disk_io_rates(self.refresh_history(
+                        'disk_io', k, v, timestamp=now))
+                        for k, v in disk_io.items()}
+
+        network_info, network_stats = self.get_network_info(now)
+
+        load_info = self._reader.read_loadavg()
+        if self._pressure_resources is None:
+            self._pressure_resources = list(self._read_pressure(
+                self._reader, sysstat.PRESSURE_RESOURCES))
+        pressure_info = self._read_pressure(
+            self._reader, self._pressure_resources)
+
+        snapshot = {
+            'cpu_info': cpu_info,
+            'cpu_core_info': cpu_core_info,
+            'sched_info': sched_info,
+            'load_info': load_info,
+            'pressure_info': pressure_info,
+            'mem_info': mem_info,
+            'disk_info': disk_info,
+            'disk_io': disk_io_info,
+            'network_info': network_info,
+            'network_stats': network_stats,
+        }
+        if self._cgroup is not None:
+            snapshot['cgroup_info'], snapshot['cgroup_io'], \
+                snapshot['cgroup_pressure'] = self.get_cgroup_info(now)
+        if self._process_sampler is not None:
+            snapshot['process_info'] = self._process_sampler.sample()
+
+        snapshot = self._publish(snapshot)
+        self._log_snapshot(snapshot, now)
+        if self._history_path is not None:
+            self._record_history(snapshot)
+        for callback in self._listeners:
+            try:
+                callback(snapshot)
+            except Exception:
+                self._logger.warning(traceback.format_exc())
+        return snapshot
+
+    def get_network_info(self, now):
+        """Network rates of every interface,
+        return (network_info, network_stats).
+
+        network_info is rx / tx in Kb/s as before, network_stats has
+        the rates per second of all counters of /proc/net/dev for every
+        horizon, e.g. rx_packets_1s, tx_drop_60s"""
+        counters = self._reader.read_network_counters()
+        for k in [k for k in self._network_rates if k not in counters]:
+            del self._network_rates[k]
+
+        network_info = {}
+        network_stats = {}
+        for k, v in counters.items():
+            rates = self._network_rates.get(k)
+            if rates is None:
+                rates = self._network_rates[k] = CounterRates(
+                    sysstat.NETDEV_FIELDS, self._network_horizons)
+            rates.update(v, now)
+            network_stats[k] = rates.all_rates()
+            info = rates.rates(self._network_info_horizon)
+            network_info[k] = {
+                'rx': info['rx_bytes'] * 8 / 1024,
+                'tx': info['tx_bytes'] * 8 / 1024,
+            } if info else {}
+        return network_info, network_stats
 
-        self._logger.info(pprint.pformat(self.output))
-        return self.output
+    @staticmethod
+    def _read_pressure(reader, resources):
+        """{resource: pressure} of the resources readable by reader"""
+        pressure = {}
+        for resource in resources:
+            try:
+                pressure[resource] = reader.read_pressure(resource)
+            except (IOError, OSError):
+                # no PSI in kernel, or disabled by psi=0
+                pass
+        return pressure
+
+    def get_cgroup_info(self, now):
+        """Usage and limits of the cgroup of this process,
+        return (cgroup_info, cgroup_io, cgroup_pressure)"""
+        cgroup = self._cgroup
+
+        cpu_stat = cgroup.read_cpu_stat()
+        cpu_buf = self.refresh_history(
+            'cgroup', 'cpu', cpu_stat, timestamp=now)
+        cpu_rates = cpu_buf.per_second()
+        cpu_delta = cpu_buf.delta()
+        cgroup_info = {}
+        if cpu_rates:
+            # us per second to percent of one CPU
+            cgroup_info['cpu_usage'] = cpu_rates['usage_usec'] / 1e4
+            cgroup_info['cpu_user'] = cpu_rates['user_usec'] / 1e4
+            cgroup_info['cpu_system'] = cpu_rates['system_usec'] / 1e4
+        if 'throttled_usec' in cpu_rates:
+            cgroup_info['throttled_time'] = cpu_rates['throttled_usec'] / 1e4
+            cgroup_info['throttled_periods'] = \
+                cpu_delta['nr_throttled'] * 100.0 / \
+                cpu_delta['nr_periods'] if cpu_delta['nr_periods'] else 0.0
+        cpu_limit = cgroup.read_cpu_max()
+        if cpu_limit is not None:
+            cgroup_info['cpu_limit'] = cpu_limit
+            if cpu_rates:
+                cgroup_info['cpu_usage_of_limit'] = \
+                    cgroup_info['cpu_usage'] / cpu_limit
+
+        memory = cgroup.read_memory()
+        cgroup_info['mem_current'] = memory['current'] >> 10  # KB
+        if memory['max'] is not None:
+            cgroup_info['mem_max'] = memory['max'] >> 10
+            cgroup_info['mem_percent'] = round(
+                memory['current'] * 100.0 / memory['max'], 2)
+
+        io_stat = cgroup.read_io_stat()
+        cgroup_io = {}
+        for k, v in io_stat.items():
+            cgroup_io[k] = self.refresh_history(
+                'cgroup', 'io ' + k, v, timestamp=now).per_second()
+
+        cgroup_pressure = self._read_pressure(
+            cgroup, sysstat.PRESSURE_RESOURCES)
+        return cgroup_info, cgroup_io, cgroup_pressure
+
+    def _next_deadline(self, deadline, now):
+        """Deadline of next tick, on the grid of update_interval
+        from the first one. Ticks missed by a slow collection are
+        skipped rather than run in a burst."""
+        deadline += self._update_interval
+        if deadline < now:
+            missed = (now - deadline) // self._update_interval + 1
+            deadline += missed * self._update_interval
+        return deadline
 
     def run(self, exit_event):
         """Run, usually as a stand alone thread
 
+        Ticks are scheduled against a monotonic deadline,
+        so the period does not drift by the collection time.
+
         :param exit_event: threading.Event
         """
+        deadline = time.monotonic()
         while not exit_event.is_set():
             try:
                 self.get_sys_info()
             except:
                 self._logger.warning(traceback.format_exc())
-            time.sleep(self._update_interval)
+            now = time.monotonic()
+            deadline = self._next_deadline(deadline, now)
+            exit_event.wait(deadline - now)
+
+    async def run_async(self, exit_event=None, in_executor=True,
+                        executor=None):
+        """Run as a task in a running asyncio event loop.
+
+        Same scheduling as run(), without a dedicated thread of its own.
+        Collection may block: os.statvfs of every mount hangs on a dead
+        NFS or autofs mount, free and df may be run as subprocesses, the
+        process sampler lists /proc and /proc/<pid>/fd. So it is run in
+        an executor by default, one tick at a time.
+        Cancel the task or set exit_event to stop.
+
+        :param exit_event: asyncio.Event, or None to run until cancelled
+        :param in_executor: if False, collect in the loop itself, which
+            only saves a thread switch per tick
+        :param executor: concurrent.futures.Executor to collect in,
+            the default executor of the loop if None
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time()
+        while exit_event is None or not exit_event.is_set():
+            try:
+                if in_executor:
+                    await loop.run_in_executor(executor, self.get_sys_info)
+                else:
+                    self.get_sys_info()
+            except Exception:
+                self._logger.warning(traceback.format_exc())
+            now = loop.time()
+            deadline = self._next_deadline(deadline, now)
+            if exit_event is None:
+                await asyncio.sleep(deadline - now)
+                continue
+            try:
+                await asyncio.wait_for(exit_event.wait(), deadline - now)
+            except asyncio.TimeoutError:
+                pass
 
 
 def main():
@@ -140,9 +567,7 @@ def main():
     logger = logging.getLogger(__name__)
     logger.info('\n\n' + '-' * 30 + '<%s>' + '-' * 30, time.asctime())
 
-    output = {}
-    sys_mon = SysMon(output)
-    import threading
+    sys_mon = SysMon(log_interval=0)
     exit_event = threading.Event()
     sys_mon.run(exit_event)
 
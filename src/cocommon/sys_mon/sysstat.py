@@ -1,24 +1,140 @@
+import os
+import re
+import time
+import array
 import subprocess
 import socket
 import fcntl
 import struct
 
 
+SIOCGIFADDR = 0x8915
+SIOCGIFCONF = 0x8912
+# sizeof(struct ifreq): name[16] and a union of 16 (32 bit) or 24 bytes
+IFREQ_SIZE = 40 if struct.calcsize('P') == 8 else 32
+
+
 def get_ip_address(ifname):
     """Get ip address by interface name
 
+    Prefer InterfaceTable if called often.
+
     :param ifname: interface name"""
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    return socket.inet_ntoa(fcntl.ioctl(s.fileno(), 0x8915,
-                            struct.pack(
-                                '256s',
-                                ifname[:15].encode('utf-8')))[20:24])
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        return socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFADDR,
+                                struct.pack(
+                                    '256s',
+                                    ifname[:15].encode('utf-8')))[20:24])
+
+
+def read_interface_addresses(max_interfaces=1024):
+    """IPv4 and IPv6 addresses of every interface.
+
+    IPv4 addresses come from a single SIOCGIFCONF ioctl (like ifconfig,
+    secondary addresses without a label are not listed),
+    IPv6 ones from /proc/net/if_inet6.
+    return a dictionary by key of every interface (aliases like eth0:1
+    included), like {'eth0': {'ipv4': ['10.0.0.2'], 'ipv6': [...]}}
+
+    :param max_interfaces: max number of IPv4 addresses returned"""
+    interfaces = {}
+    for _, ifname in socket.if_nameindex():
+        interfaces[ifname] = {'ipv4': [], 'ipv6': []}
+
+    buf = array.array('B', bytes(IFREQ_SIZE * max_interfaces))
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        ifconf = fcntl.ioctl(s.fileno(), SIOCGIFCONF, struct.pack(
+            'iP', len(buf), buf.buffer_info()[0]))
+    length = struct.unpack('iP', ifconf)[0]
+    data = buf.tobytes()
+    for i in range(0, length, IFREQ_SIZE):
+        ifname = data[i:i + 16].split(b'\0', 1)[0].decode()
+        # struct sockaddr_in: family(2) port(2) addr(4)
+        address = socket.inet_ntoa(data[i + 20:i + 24])
+        interfaces.setdefault(ifname, {'ipv4': [], 'ipv6': []})[
+            'ipv4'].append(address)
+
+    # Example of /proc/net/if_inet6:
+    # address index prefix_len scope flags name
+    # fe80000000000000020c29fffe4be6d7 02 40 20 80     eth0
+
+    try:
+        with open('/proc/net/if_inet6', 'rb') as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        # IPv6 disabled
+        lines = []
+    for line in lines:
+        values = line.split()
+        if len(values) < 6:
+            continue
+        address = socket.inet_ntop(
+            socket.AF_INET6, bytes.fromhex(values[0].decode()))
+        interfaces.setdefault(values[5].decode(), {'ipv4': [], 'ipv6': []})[
+            'ipv6'].append(address)
+
+    return interfaces
+
+
+class InterfaceTable(object):
+
+    """Cache of read_interface_addresses, refreshed when older than ttl.
+
+    Lookups are dictionary lookups, no socket is created.
+
+    :param ttl: seconds before the cache is refreshed on next lookup,
+        call refresh() when interfaces are known to have changed"""
+
+    def __init__(self, ttl=60):
+        self._ttl = ttl
+        self._interfaces = {}
+        self._expire_time = None
+
+    def refresh(self):
+        """Reread all interfaces now"""
+        interfaces = read_interface_addresses()
+        # a single reference swap, readers see the old or the new table
+        self._interfaces = interfaces
+        self._expire_time = time.monotonic() + self._ttl
+        return interfaces
+
+    def interfaces(self):
+        """All interfaces and their addresses"""
+        if self._expire_time is None or time.monotonic() >= self._expire_time:
+            return self.refresh()
+        return self._interfaces
+
+    def get(self, ifname):
+        """{'ipv4': [...], 'ipv6': [...]} of an interface,
+        None if there is no such interface"""
+        return self.interfaces().get(ifname)
+
+    def get_ip_address(self, ifname):
+        """First IPv4 address of an interface,
+        None if the interface does not exist or has no IPv4 address"""
+        interface = self.interfaces().get(ifname)
+        if interface and interface['ipv4']:
+            return interface['ipv4'][0]
+        return None
 
 
-def read_cpu_usage():
+CPU_FIELDS = ('usr', 'nice', 'sys', 'idle', 'iowait', 'irq', 'softirq',
+              'steal', 'guest', 'guest_nice')
+# guest and guest_nice are already accounted in usr and nice
+CPU_BASE_FIELDS = CPU_FIELDS[:8]
+SCHED_FIELDS = ('ctxt', 'intr', 'processes', 'procs_running', 'procs_blocked')
+
+
+def read_cpu_usage(per_core=False):
     """CPU usage from /proc/stat.
 
-    http://man7.org/linux/man-pages/man5/proc.5.html"""
+    http://man7.org/linux/man-pages/man5/proc.5.html
+
+    :param per_core: if False, return the aggregate cpu line only
+        (without guest time).
+        If True, parse the whole file in one pass and return a dict with
+        'cpu' (aggregate), 'cores' (by cpuN), all CPU_FIELDS for each,
+        and the scheduler counters in SCHED_FIELDS"""
     # Example:
     # cpu  71629 16549 132174 573280 15806 666 0 0 0 0
     # cpu0 7377 4326 32179 154633 3787 115 0 0 0 0
@@ -33,10 +149,19 @@ def read_cpu_usage():
     # procs_blocked 0
     # softirq 1291594 70 669951 569 54212 279315 0 3139 139057 1785 143496
 
-    cpu_usage = {}
-    with open('/proc/stat', 'r') as f:
-        data = f.readline().split()
+    if per_core:
+        with open('/proc/stat', 'rb') as f:
+            return parse_cpu_stat(f.read())
+    with open('/proc/stat', 'rb') as f:
+        return parse_cpu_usage(f.readline())
 
+
+def parse_cpu_usage(data):
+    """Parse the aggregate cpu line of /proc/stat (bytes),
+    see read_cpu_usage()"""
+    data = data.split(b'\n', 1)[0].split()
+
+    cpu_usage = {}
     cpu_usage['usr'] = int(data[1])
     cpu_usage['nice'] = int(data[2])
     cpu_usage['sys'] = int(data[3])
@@ -49,7 +174,76 @@ def read_cpu_usage():
     return cpu_usage
 
 
+def parse_cpu_stat(data):
+    """Parse content of /proc/stat (bytes), see read_cpu_usage(per_core=True).
+
+    Fields missing on older kernels are reported as 0."""
+    n_fields = len(CPU_FIELDS)
+    cpu_stat = {'cores': {}}
+    for line in data.splitlines():
+        values = line.split()
+        if not values:
+            continue
+        key = values[0]
+        if key.startswith(b'cpu'):
+            counters = [int(i) for i in values[1:n_fields + 1]]
+            counters.extend([0] * (n_fields - len(counters)))
+            counters = dict(zip(CPU_FIELDS, counters))
+            if key == b'cpu':
+                cpu_stat['cpu'] = counters
+            else:
+                cpu_stat['cores'][key.decode()] = counters
+        elif key == b'intr':
+            # only the total, not every single interrupt
+            cpu_stat['intr'] = int(values[1])
+        elif key in (b'ctxt', b'processes',
+                     b'procs_running', b'procs_blocked'):
+            cpu_stat[key.decode()] = int(values[1])
+
+    return cpu_stat
+
+
 def read_mem_usage():
+    """MEM usage, from /proc/meminfo if possible, else by free."""
+    try:
+        return read_mem_usage_from_proc()
+    except (IOError, OSError, KeyError, ValueError):
+        return read_mem_usage_by_free()
+
+
+def read_mem_usage_from_proc():
+    """MEM usage from /proc/meminfo.
+
+    Same keys and units (KB) as read_mem_usage_by_free."""
+
+    # Example:
+    # MemTotal:        1017972 kB
+    # MemFree:           87340 kB
+    # Buffers:           92860 kB
+    # Cached:           545564 kB
+
+    with open('/proc/meminfo', 'rb') as f:
+        return parse_meminfo(f.read())
+
+
+def parse_meminfo(data):
+    """Parse content of /proc/meminfo (bytes), see read_mem_usage()"""
+    meminfo = {}
+    for line in data.splitlines():
+        key, value = line.split(b':', 1)
+        meminfo[key] = int(value.split()[0])
+
+    mem_usage = {}
+    mem_usage['total'] = meminfo[b'MemTotal']
+    mem_usage['free'] = meminfo[b'MemFree']
+    mem_usage['used'] = mem_usage['total'] - mem_usage['free']
+    mem_usage['buffers'] = meminfo[b'Buffers']
+    mem_usage['cached'] = meminfo[b'Cached']
+
+    return mem_usage
+
+
+def read_mem_usage_by_free():
     """MEM usage by free."""
 
     # Example:
@@ -71,16 +265,77 @@ def read_mem_usage():
 
 
 def read_disk_usage():
+    """DISK usage, from /proc/self/mounts and statvfs if possible, else by df.
+    """
+    try:
+        return read_disk_usage_from_proc()
+    except (IOError, OSError, ValueError):
+        return read_disk_usage_by_df()
+
+
+def _unescape_mount_field(field):
+    """Undo octal escapes (e.g. \\040 for space) in /proc/self/mounts."""
+    if '\\' not in field:
+        return field
+    return re.sub(r'\\([0-7]{3})',
+                  lambda m: chr(int(m.group(1), 8)), field)
+
+
+def read_disk_usage_from_proc():
+    """DISK usage of mounts in /proc/self/mounts by os.statvfs.
+
+    Same keys and units (MB) as read_disk_usage_by_df.
+    Like df, pseudo filesystems with zero blocks are skipped and
+    a device mounted more than once is only reported once."""
+
+    # Example:
+    # /dev/xvda1 / ext4 rw,relatime,data=ordered 0 0
+
+    with open('/proc/self/mounts', 'rb') as f:
+        return disk_usage_of_mounts(f.read())
+
+
+def disk_usage_of_mounts(data):
+    """DISK usage of every mount in content of /proc/self/mounts (bytes),
+    see read_disk_usage_from_proc()"""
+    disk_usage = {}
+    for line in data.splitlines():
+        fields = line.decode('utf-8', 'replace').split()
+        if len(fields) < 2:
+            continue
+        device = _unescape_mount_field(fields[0])
+        if device in disk_usage:
+            continue
+        try:
+            st = os.statvfs(_unescape_mount_field(fields[1]))
+        except OSError:
+            continue
+        if st.f_blocks == 0:
+            continue
+        disk_usage[device] = {
+            'total': (st.f_blocks * st.f_frsize) >> 20,  # MB
+            'used': ((st.f_blocks - st.f_bfree) * st.f_frsize) >> 20,
+            'free': (st.f_bavail * st.f_frsize) >> 20
+        }
+
+    return disk_usage
+
+
+def read_disk_usage_by_df():
     """DISK usage by df."""
 
     # Example:
     # Filesystem     1K-blocks     Used Available Use% Mounted on
     # /dev/xvda1      20903812 13288612   6566728  67% /
 
-    disk_usage = {}
     df_output = subprocess.check_output(
         ['df'], universal_newlines=True, close_fds=True)
+    return parse_df(df_output)
 
+
+def parse_df(df_output):
+    """Parse output of df -k (str), see read_disk_usage_by_df()"""
+    disk_usage = {}
     lines = df_output.splitlines()[1:]
     for line in lines:
         data = line.split()
@@ -96,13 +351,16 @@ def read_disk_usage():
 def read_network_usage():
     """Network usage from /proc/net/dev."""
 
-    network_usage = {}
-    with open('/proc/net/dev', 'r') as f:
-        lines = f.readlines()
+    with open('/proc/net/dev', 'rb') as f:
+        return parse_network_usage(f.read())
+
 
-    for line in lines[2:]:
-        iface, stats = line.split(':')
-        iface = iface.strip()
+def parse_network_usage(data):
+    """Parse content of /proc/net/dev (bytes), see read_network_usage()"""
+    network_usage = {}
+    for line in data.splitlines()[2:]:
+        iface, stats = line.split(b':', 1)
+        iface = iface.strip().decode()
 
         stats = stats.split()
         network_usage.update({
@@ -119,13 +377,16 @@ def read_network_usage_v2():
     return a dictionary by key of every interface
     Recommended version."""
 
-    network_usage = {}
-    with open('/proc/net/dev', 'r') as f:
-        lines = f.readlines()
+    with open('/proc/net/dev', 'rb') as f:
+        return parse_network_usage_v2(f.read())
+
 
-    for line in lines[2:]:
-        iface, stats = line.split(':')
-        iface = iface.strip()
+def parse_network_usage_v2(data):
+    """Parse content of /proc/net/dev (bytes), see read_network_usage_v2()"""
+    network_usage = {}
+    for line in data.splitlines()[2:]:
+        iface, stats = line.split(b':', 1)
+        iface = iface.strip().decode()
 
         stats = stats.split()
         network_usage[iface] = {
@@ -134,3 +395,382 @@ def read_network_usage_v2():
         }
 
     return network_usage
+
+
+NETDEV_FIELDS = ('rx_bytes', 'rx_packets', 'rx_errs', 'rx_drop', 'rx_fifo',
+                 'rx_frame', 'rx_compressed', 'rx_multicast',
+                 'tx_bytes', 'tx_packets', 'tx_errs', 'tx_drop', 'tx_fifo',
+                 'tx_colls', 'tx_carrier', 'tx_compressed')
+
+
+def read_network_counters():
+    """All raw counters of every interface from /proc/net/dev.
+
+    return a dictionary by key of every interface,
+    with the NETDEV_FIELDS of each, not scaled"""
+
+    # Example (Receive fields, then Transmit fields):
+    # Inter-|   Receive                                           |  Transmit
+    #  face |bytes    packets errs drop fifo frame compressed mul...|bytes ...
+    #   eth0: 1104914   10467    0    0    0     0          0    ...  2039 ...
+
+    with open('/proc/net/dev', 'rb') as f:
+        return parse_network_counters(f.read())
+
+
+def parse_network_counters(data):
+    """Parse content of /proc/net/dev (bytes), see read_network_counters()"""
+    network_counters = {}
+    for line in data.splitlines()[2:]:
+        iface, stats = line.split(b':', 1)
+        network_counters[iface.strip().decode()] = dict(zip(
+            NETDEV_FIELDS, [int(i) for i in stats.split()]))
+
+    return network_counters
+
+
+DISKSTATS_FIELDS = ('reads', 'reads_merged', 'read_sectors', 'read_ms',
+                    'writes', 'writes_merged', 'write_sectors', 'write_ms',
+                    'in_progress', 'io_ms', 'weighted_io_ms')
+
+
+def read_disk_io(skip_idle=True):
+    """Disk I/O counters from /proc/diskstats.
+
+    https://www.kernel.org/doc/Documentation/iostats.txt
+
+    return a dictionary by key of every block device,
+    sectors are always 512 bytes, times are in ms.
+
+    :param skip_idle: skip devices which never did any I/O,
+        like unused loop and ram devices"""
+
+    # Example:
+    #  202       1 xvda1 31478 30 1378226 136396 1015322 2114063 ...
+
+    with open('/proc/diskstats', 'rb') as f:
+        return parse_diskstats(f.read(), skip_idle)
+
+
+def parse_diskstats(data, skip_idle=True):
+    """Parse content of /proc/diskstats (bytes), see read_disk_io()"""
+    n_fields = len(DISKSTATS_FIELDS)
+    disk_io = {}
+    for line in data.splitlines():
+        values = line.split()
+        if len(values) < n_fields + 3:
+            continue
+        counters = [int(i) for i in values[3:n_fields + 3]]
+        if skip_idle and not counters[0] and not counters[4]:
+            continue
+        disk_io[values[2].decode()] = dict(zip(DISKSTATS_FIELDS, counters))
+
+    return disk_io
+
+
+def read_loadavg():
+    """Load average and number of tasks from /proc/loadavg."""
+
+    # Example:
+    # 0.20 0.18 0.12 1/80 11206
+
+    with open('/proc/loadavg', 'rb') as f:
+        return parse_loadavg(f.read())
+
+
+def parse_loadavg(data):
+    """Parse content of /proc/loadavg (bytes), see read_loadavg()"""
+    values = data.split()
+    running, total = values[3].split(b'/')
+    return {
+        'load1': float(values[0]),
+        'load5': float(values[1]),
+        'load15': float(values[2]),
+        'running': int(running),
+        'total': int(total),
+    }
+
+
+PRESSURE_RESOURCES = ('cpu', 'memory', 'io')
+
+
+def read_pressure(resource):
+    """Pressure stall information from /proc/pressure/<resource>.
+
+    https://www.kernel.org/doc/html/latest/accounting/psi.html
+
+    return a dictionary like {'some_avg10': 0.0, 'some_total': 1234, ...},
+    avgs are percents of time stalled, totals are stalled time in us.
+
+    :param resource: cpu | memory | io"""
+
+    # Example:
+    # some avg10=0.00 avg60=0.00 avg300=0.00 total=0
+    # full avg10=0.00 avg60=0.00 avg300=0.00 total=0
+
+    with open(os.path.join('/proc/pressure', resource), 'rb') as f:
+        return parse_pressure(f.read())
+
+
+def parse_pressure(data):
+    """Parse content of /proc/pressure/* or a cgroup's *.pressure (bytes),
+    see read_pressure()"""
+    pressure = {}
+    for line in data.splitlines():
+        values = line.split()
+        if not values:
+            continue
+        kind = values[0].decode()
+        for item in values[1:]:
+            key, value = item.split(b'=')
+            key = key.decode()
+            pressure[kind + '_' + key] = int(value) if key == 'total' \
+                else float(value)
+    return pressure
+
+
+def find_cgroup(proc_root='/proc', cgroup_root='/sys/fs/cgroup'):
+    """Directory of the cgroup v2 this process belongs to.
+
+    return None if cgroup v2 is not mounted at cgroup_root or the process
+    is in the root cgroup, i.e. not limited by a container.
+    Inside a cgroup namespace, the cgroup is seen as '/' but has the
+    files of a non-root cgroup, so it is detected as well."""
+
+    # Example of /proc/self/cgroup with cgroup v2:
+    # 0::/system.slice/docker-0123abcd.scope
+
+    try:
+        with open(os.path.join(proc_root, 'self/cgroup'), 'rb') as f:
+            data = f.read()
+    except (IOError, OSError):
+        return None
+    for line in data.splitlines():
+        if line.startswith(b'0::'):
+            path = os.path.join(
+                cgroup_root, line[3:].decode().strip().lstrip('/'))
+            # the root cgroup has neither of them
+            if os.path.isfile(os.path.join(path, 'cpu.stat')) and \
+                    os.path.isfile(os.path.join(path, 'memory.current')):
+                return path
+    return None
+
+
+def parse_flat_keyed(data):
+    """Parse cgroup v2 files of 'key value' lines (bytes),
+    like cpu.stat and memory.stat"""
+    result = {}
+    for line in data.splitlines():
+        values = line.split()
+        if len(values) == 2:
+            result[values[0].decode()] = int(values[1])
+    return result
+
+
+def parse_cgroup_cpu_max(data):
+    """Parse content of cgroup v2 cpu.max (bytes),
+    return the limit in number of CPUs, or None if not limited"""
+
+    # Example:
+    # 150000 100000
+
+    quota, period = data.split()
+    if quota == b'max':
+        return None
+    return int(quota) / float(period)
+
+
+def parse_cgroup_memory_max(data):
+    """Parse content of cgroup v2 memory.max (bytes),
+    return the limit in bytes, or None if not limited"""
+    data = data.strip()
+    if data == b'max':
+        return None
+    return int(data)
+
+
+def parse_cgroup_io_stat(data):
+    """Parse content of cgroup v2 io.stat (bytes),
+    return a dictionary by key of every device (major:minor)"""
+
+    # Example:
+    # 8:0 rbytes=90112 wbytes=0 rios=11 wios=0 dbytes=0 dios=0
+
+    io_stat = {}
+    for line in data.splitlines():
+        values = line.split()
+        if not values:
+            continue
+        counters = {}
+        for item in values[1:]:
+            key, value = item.split(b'=')
+            counters[key.decode()] = int(value)
+        io_stat[values[0].decode()] = counters
+    return io_stat
+
+
+class ProcReader(object):
+
+    """Keep a file under /proc open and reread it into a reused buffer.
+
+    Opening a /proc file costs more than reading it,
+    so sampling loops should keep one of these per file.
+
+    :param path: file to read
+    :param bufsize: initial buffer size, grows if the file is larger"""
+
+    def __init__(self, path, bufsize=4096):
+        self.path = path
+        self._buf = bytearray(bufsize)
+        self._fd = None
+        self._fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+
+    def read(self):
+        """Read the whole file from offset 0, return bytes"""
+        buf = self._buf
+        n = 0
+        while True:
+            # seq_file based files may return short reads before EOF
+            got = os.preadv(self._fd, [memoryview(buf)[n:]], n)
+            if not got:
+                break
+            n += got
+            if n == len(buf):
+                buf.extend(bytes(len(buf)))
+        # one copy, slicing the bytearray itself would make two
+        return bytes(memoryview(buf)[:n])
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+class ProcStatReader(object):
+
+    """Same as the read_* functions of this module,
+    but keeps the files under /proc open between calls.
+
+    :param proc_root: mount point of procfs, changed for test fixtures"""
+
+    def __init__(self, proc_root='/proc'):
+        self._proc_root = proc_root
+        self._readers = {}
+
+    def read(self, name):
+        """Content of <proc_root>/<name> in bytes,
+        the file is opened on first call"""
+        reader = self._readers.get(name)
+        if reader is None:
+            reader = self._readers[name] = ProcReader(
+                os.path.join(self._proc_root, name))
+        return reader.read()
+
+    def read_cpu_usage(self, per_core=False):
+        if per_core:
+            return parse_cpu_stat(self.read('stat'))
+        return parse_cpu_usage(self.read('stat'))
+
+    def read_mem_usage(self):
+        try:
+            return parse_meminfo(self.read('meminfo'))
+        except (IOError, OSError, KeyError, ValueError):
+            return read_mem_usage_by_free()
+
+    def read_disk_usage(self):
+        try:
+            return disk_usage_of_mounts(self.read('self/mounts'))
+        except (IOError, OSError, ValueError):
+            return read_disk_usage_by_df()
+
+    def read_disk_io(self, skip_idle=True):
+        return parse_diskstats(self.read('diskstats'), skip_idle)
+
+    def read_loadavg(self):
+        return parse_loadavg(self.read('loadavg'))
+
+    def read_pressure(self, resource):
+        return parse_pressure(self.read(os.path.join('pressure', resource)))
+
+    def read_network_usage(self):
+        return parse_network_usage(self.read('net/dev'))
+
+    def read_network_usage_v2(self):
+        return parse_network_usage_v2(self.read('net/dev'))
+
+    def read_network_counters(self):
+        return parse_network_counters(self.read('net/dev'))
+
+    def close(self):
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = {}
+
+
+class CgroupReader(object):
+
+    """Read usage and limits of a cgroup v2, keeping its files open.
+
+    :param path: directory of the cgroup, see find_cgroup()"""
+
+    def __init__(self, path):
+        self.path = path
+        self._readers = {}
+
+    def read(self, name):
+        """Content of file name of the cgroup in bytes,
+        the file is opened on first call"""
+        reader = self._readers.get(name)
+        if reader is None:
+            reader = self._readers[name] = ProcReader(
+                os.path.join(self.path, name))
+        return reader.read()
+
+    def read_cpu_stat(self):
+        """Counters of cpu.stat, times in us"""
+        return parse_flat_keyed(self.read('cpu.stat'))
+
+    def read_cpu_max(self):
+        """Limit in number of CPUs, None if not limited"""
+        try:
+            return parse_cgroup_cpu_max(self.read('cpu.max'))
+        except (IOError, OSError):
+            # cpu controller not enabled for this cgroup
+            return None
+
+    def read_memory(self):
+        """Memory usage and limit in bytes, limit is None if not limited"""
+        try:
+            limit = parse_cgroup_memory_max(self.read('memory.max'))
+        except (IOError, OSError):
+            limit = None
+        return {
+            'current': int(self.read('memory.current')),
+            'max': limit,
+        }
+
+    def read_io_stat(self):
+        """Counters of io.stat by device, empty if io controller
+        is not enabled for this cgroup"""
+        try:
+            return parse_cgroup_io_stat(self.read('io.stat'))
+        except (IOError, OSError):
+            return {}
+
+    def read_pressure(self, resource):
+        """Pressure stall information of the cgroup, see read_pressure()"""
+        return parse_pressure(self.read(resource + '.pressure'))
+
+    def close(self):
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = {}
@@ -16,10 +16,6 @@ import glob
 import tempfile
 import pickle
 
-import pexpect
-import requests
-import paramiko
-
 from . import rst_gen
 from .compat import urlparse, get_urlparsable_string
 
@@ -47,6 +43,7 @@ def request_url_and_cache_result(url, method='GET', data=None,
     :param cache_dir: The dir to save the cache file name
     :param expire_time: Cache expiration time
     :param flush: Force flushing cache"""
+    import requests
     logger = logging.getLogger(__name__)
 
     if method not in ['GET', 'POST']:
@@ -145,6 +142,7 @@ def do_host(
         expect_done_sign=']#',
         timeout=30):
     """Run a list of commands on a host."""
+    import pexpect
     logger = logging.getLogger(__name__)
     logger.info('ssh to %s:%s@%s', username, password, host)
     child = pexpect.spawn(
@@ -186,6 +184,7 @@ def do_host_paramiko(
         port=22,
         timeout=30):
     """Run a list of commands on a remote host with paramiko."""
+    import paramiko
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     ssh.connect(host, port, username, password)
@@ -236,6 +235,7 @@ def req_url_with_auth(url, username=None, password=None, retry_times=5):
 
     >>> req_url_with_auth('http://121.199.18.53/live.html')
     <Response [200]>"""
+    import requests
     logger = logging.getLogger(__name__)
     e = None
     while retry_times:
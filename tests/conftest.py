@@ -0,0 +1,37 @@
+"""
+Shared fixtures of the tests
+
+Run from the repository root:
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+import shutil
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'fixtures')
+PROC_ROOT = os.path.join(FIXTURES, 'proc')
+CGROUP_ROOT = os.path.join(FIXTURES, 'sys', 'fs', 'cgroup')
+CGROUP_PATH = os.path.join(CGROUP_ROOT, 'system.slice', 'app.scope')
+
+
+@pytest.fixture
+def fixture_copy(tmp_path):
+    """A writable copy of the fixtures, returns (proc_root, cgroup_root)"""
+    root = str(tmp_path / 'fixtures')
+    shutil.copytree(FIXTURES, root)
+    return os.path.join(root, 'proc'), os.path.join(root, 'sys', 'fs',
+                                                    'cgroup')
+
+
+def rewrite(path, content):
+    """Replace the content of a fixture file in place, like the kernel
+    does, so that readers keeping it open see the new content"""
+    with open(path, 'w') as f:
+        f.write(content)
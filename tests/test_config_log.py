@@ -0,0 +1,407 @@
+import os
+import sys
+import gzip
+import json
+import time
+import socket
+import logging
+import threading
+import subprocess
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+import ujson
+
+from cocommon.quick_config import config_log as cl
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+class FluentStandIn(object):
+
+    """Local TCP stand-in for fluentd, keeps every byte received"""
+
+    def __init__(self, port=0):
+        self._socket = socket.socket()
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('127.0.0.1', port))
+        self._socket.listen(8)
+        self.port = self._socket.getsockname()[1]
+        self.data = bytearray()
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._socket.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self._read, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _read(self, conn):
+        with conn:
+            while True:
+                data = conn.recv(1 << 16)
+                if not data:
+                    return
+                with self._lock:
+                    self.data += data
+
+    def messages(self):
+        """Forward protocol messages received so far"""
+        import msgpack
+        unpacker = msgpack.Unpacker(raw=False)
+        with self._lock:
+            unpacker.feed(bytes(self.data))
+        return list(unpacker)
+
+    def close(self):
+        self._socket.close()
+
+
+class _HTTPStandIn(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            self.server.batches.append(json.loads(body.decode('utf-8')))
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, fmt, *args):
+            pass
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), self.Handler)
+        self.batches = []
+
+
+@pytest.fixture
+def http_stand_in():
+    server = _HTTPStandIn()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _dead_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def _logger(name, *handlers):
+    logger = logging.getLogger('test_config_log.' + name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers = list(handlers)
+    return logger
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.records = []
+        self.closed = False
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def close(self):
+        self.closed = True
+        super(ListHandler, self).close()
+
+
+def _record(msg='message', level=logging.INFO, created=1000.0, lineno=1):
+    return logging.makeLogRecord({
+        'name': 'test', 'levelno': level,
+        'levelname': logging.getLevelName(level), 'msg': msg,
+        'created': created, 'pathname': 'test.py', 'lineno': lineno})
+
+
+def test_queue_hands_records_unchanged():
+    behind = ListHandler()
+    queued = cl.AsyncQueueHandler([behind])
+    logger = _logger('queue', queued)
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        logger.exception('failed for user %s', 42)
+    queued.close()
+    record, = behind.records
+    assert record.msg == 'failed for user %s'
+    assert record.args == (42,)
+    assert record.exc_info[0] is ValueError
+    # closed by the queue once drained
+    assert behind.closed
+    # closing again is harmless
+    queued.close()
+
+
+def test_queue_full_drop():
+    release = threading.Event()
+
+    class Blocked(logging.Handler):
+        def emit(self, record):
+            release.wait(10)
+
+    queued = cl.AsyncQueueHandler([Blocked()], queue_size=2,
+                                  queue_full='drop')
+    logger = _logger('queue_drop', queued)
+    for i in range(10):
+        logger.info('%d', i)
+    # one taken by the listener, two waiting
+    assert queued.dropped >= 7
+    release.set()
+    queued.close()
+
+
+def test_packed_forward_framing():
+    pytest.importorskip('msgpack')
+    import msgpack
+    fluentd = FluentStandIn()
+    h = cl.BufferedFluentHandler('app.log', port=fluentd.port,
+                                 batch_size=3, flush_interval=60)
+    logger = _logger('fluent', h)
+    try:
+        for i in range(5):
+            logger.info('record %d', i)
+        h.flush(5)
+        time.sleep(0.2)
+    finally:
+        h.close()
+        fluentd.close()
+
+    messages = fluentd.messages()
+    assert [m[0] for m in messages] == ['app.log', 'app.log']
+    assert [m[2] for m in messages] == [{'size': 3}, {'size': 2}]
+    entries = []
+    for _, packed, _ in messages:
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(packed)
+        entries.extend(unpacker)
+    assert [e[1]['message'] for e in entries] == \
+        ['record {}'.format(i) for i in range(5)]
+    assert all(isinstance(e[0], int) for e in entries)
+
+
+def test_fluent_spool_replayed_in_order(tmp_path):
+    pytest.importorskip('msgpack')
+    port = _dead_port()
+    spool_dir = str(tmp_path / 'spool')
+    h = cl.BufferedFluentHandler('app', port=port, batch_size=100,
+                                 flush_interval=60, spool_dir=spool_dir)
+    logger = _logger('fluent_spool', h)
+    fluentd = None
+    try:
+        for i in range(3):
+            logger.info('spooled %d', i)
+        h.flush(5)
+        assert len(os.listdir(spool_dir)) == 1
+
+        fluentd = FluentStandIn(port)
+        # after the first backoff of 1 s
+        time.sleep(1.1)
+        logger.info('live')
+        h.flush(5)
+        time.sleep(0.2)
+        assert os.listdir(spool_dir) == []
+    finally:
+        h.close()
+        if fluentd is not None:
+            fluentd.close()
+    assert [m[2]['size'] for m in fluentd.messages()] == [3, 1]
+
+
+def test_batching_http(http_stand_in):
+    h = cl.BatchingHTTPHandler(
+        '127.0.0.1:{}'.format(http_stand_in.server_address[1]), '/log',
+        batch_size=2, flush_interval=60, extra_message='extra')
+    logger = _logger('http', h)
+    try:
+        for i in range(5):
+            logger.warning('record %d', i)
+        h.flush(5)
+    finally:
+        h.close()
+    assert [len(b) for b in http_stand_in.batches] == [2, 2, 1]
+    records = [r for b in http_stand_in.batches for r in b]
+    assert [r['message'] for r in records] == \
+        ['record {}'.format(i) for i in range(5)]
+    assert records[0]['extra_message'] == 'extra'
+    assert records[0]['levelname'] == 'WARNING'
+
+
+def test_batching_http_dead_sink():
+    h = cl.BatchingHTTPHandler('127.0.0.1:{}'.format(_dead_port()), '/log')
+    logger = _logger('http_dead', h)
+    logger.warning('lost')
+    start = time.monotonic()
+    # returns once sending failed, rather than retrying forever
+    h.flush()
+    h.close()
+    assert time.monotonic() - start < 5
+    assert h.dropped == 1
+    h.emit(_record())
+    assert h.dropped == 2
+
+
+EXIT_SCRIPT = '''
+import sys, time, logging
+sys.path.insert(0, {src!r})
+from cocommon.quick_config import config_log as cl
+
+class Slow(logging.Handler):
+    def emit(self, record):
+        time.sleep(0.001)
+
+logger = cl.config_log(None, None, name='exit', use_queue=True,
+                       enable_stream_handler=False)
+cl._add_handler(logger, Slow())
+cl.add_one_time_http_handler(logger, {host!r}, '/log', batch=True)
+for i in range(500):
+    logger.warning('record %d', i)
+'''
+
+
+def test_batching_http_behind_queue_flushed_at_exit(http_stand_in):
+    host = '127.0.0.1:{}'.format(http_stand_in.server_address[1])
+    subprocess.check_call(
+        [sys.executable, '-c', EXIT_SCRIPT.format(src=SRC, host=host)],
+        timeout=60)
+    assert sum(len(b) for b in http_stand_in.batches) == 500
+
+
+def test_compressing_rotation(tmp_path):
+    path = str(tmp_path / 'app.log')
+    h = cl.CompressingRotatingFileHandler(
+        path, max_bytes=200, when=None, back_count=3, compress='gzip')
+    h.setFormatter(logging.Formatter('%(message)s'))
+    logger = _logger('compress', h)
+    for i in range(20):
+        logger.info('%02d %s', i, 'x' * 47)
+    h.close()
+    backups = h.backups()
+    assert len(backups) == 3
+    assert all(b.endswith('.gz') for b in backups)
+    lines = []
+    for b in backups:
+        with gzip.open(b, 'rt') as f:
+            lines += f.read().splitlines()
+    with open(path) as f:
+        lines += f.read().splitlines()
+    numbers = [int(line.split()[0]) for line in lines]
+    assert numbers == list(range(20 - len(numbers), 20))
+    assert h.error is None
+
+
+def test_compression_failure_does_not_block_close(tmp_path, capsys):
+    path = str(tmp_path / 'app.log')
+    h = cl.CompressingRotatingFileHandler(path, max_bytes=100, when=None,
+                                          compress='gzip')
+
+    def fail(path):
+        time.sleep(0.1)
+        raise IOError('disk full')
+
+    h._compress = fail
+    logger = _logger('compress_fail', h)
+    for i in range(3):
+        logger.info('x' * 80)
+    closer = threading.Thread(target=h.close)
+    closer.start()
+    # meanwhile records may still be logged
+    logger.info('while closing')
+    closer.join(10)
+    assert not closer.is_alive()
+    assert isinstance(h.error, IOError)
+    assert 'disk full' in capsys.readouterr().err
+
+
+def test_config_log_rejects_ignored_options(tmp_path):
+    with pytest.raises(ValueError):
+        cl.config_log(str(tmp_path), 'a.log', name='reject',
+                      process_safe=True, max_bytes=1000)
+    with pytest.raises(ValueError):
+        cl.config_log(str(tmp_path), 'a.log', name='reject', rotate=False,
+                      compress='gzip')
+
+
+def test_rate_limit_filter():
+    f = cl.RateLimitFilter(rate=1, burst=2)
+    assert [f.filter(_record(created=1000.0)) for _ in range(4)] == \
+        [True, True, False, False]
+    # the same record seen by another handler is not counted again
+    record = _record(created=1000.0)
+    assert f.filter(record) is False
+    assert f.filter(record) is False
+    record = _record(created=1002.0)
+    assert f.filter(record)
+    assert record.msg == 'message [suppressed 3 by rate limit]'
+    # other call sites and levels above max_level have their own budget
+    assert f.filter(_record(created=1002.0, lineno=2))
+    assert all(f.filter(_record(level=logging.ERROR, created=1002.0))
+               for _ in range(10))
+
+
+def test_dedup_filter():
+    f = cl.DedupFilter(window=60)
+    assert f.filter(_record(created=0.0))
+    assert not f.filter(_record(created=10.0))
+    assert not f.filter(_record(created=20.0))
+    assert f.filter(_record('other', created=20.0))
+    record = _record(created=61.0)
+    assert f.filter(record)
+    assert record.msg == 'message [suppressed 2 repeats]'
+
+
+def test_json_formatter():
+    formatter = cl.JSONFormatter(extra={'service': 'api'})
+    record = logging.LogRecord('app', logging.WARNING, '/src/mod.py', 12,
+                               'hello %s', ('world',), None, 'func')
+    data = ujson.loads(formatter.format(record))
+    assert data['message'] == 'hello world'
+    assert data['level'] == 'WARNING'
+    assert data['logger'] == 'app'
+    assert data['line'] == 12
+    assert data['function'] == 'func'
+    assert data['service'] == 'api'
+    assert data['time'].endswith('.{:03d}'.format(int(record.msecs)))
+    assert 'exc_text' not in data
+
+
+def test_flight_recorder(tmp_path):
+    path = str(tmp_path / 'app.flight')
+    h = cl.FlightRecorderHandler(path, capacity=3, dump_signal=None,
+                                 dump_at_exit=False)
+    h.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+    logger = _logger('flight', h)
+    for i in range(5):
+        logger.debug('debug %d', i)
+    assert not os.path.exists(path)
+    logger.error('failed')
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines[0].startswith('--- flight recorder: 3 records, ERROR')
+    assert lines[1:] == ['DEBUG debug 3', 'DEBUG debug 4', 'ERROR failed']
+    assert h.dump() == 0
+    h.close()
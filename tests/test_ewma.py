@@ -0,0 +1,51 @@
+from cocommon.sys_mon.ewma import counter_delta, CounterRates, WRAP_32, \
+    WRAP_64
+
+
+def test_counter_delta():
+    assert counter_delta(100, 150) == 50
+    assert counter_delta(100, 100) == 0
+    # 32 bit counter wrapped
+    assert counter_delta(WRAP_32 - 10, 5) == 15
+    # 64 bit counter wrapped
+    assert counter_delta(WRAP_64 - 10, 5) == 15
+    # reset, e.g. the interface was recreated
+    assert counter_delta(1000, 10) == 10
+    assert counter_delta(WRAP_32 + 1000, 10) == 10
+
+
+def test_counter_rates_steady():
+    rates = CounterRates(('rx', 'tx'), horizons=(1, 10))
+    rates.update({'rx': 0, 'tx': 0}, 0)
+    assert rates.rates(1) == {}
+    assert rates.all_rates() == {}
+    for t in range(1, 6):
+        rates.update({'rx': 100 * t, 'tx': 50 * t}, t)
+    assert rates.rates(10) == {'rx': 100.0, 'tx': 50.0}
+    assert rates.all_rates() == {'rx_1s': 100.0, 'tx_1s': 50.0,
+                                 'rx_10s': 100.0, 'tx_10s': 50.0}
+
+
+def test_counter_rates_wrap_and_smoothing():
+    rates = CounterRates(('rx',), horizons=(1, 60))
+    start = WRAP_32 - 150
+    rates.update({'rx': start}, 0)
+    rates.update({'rx': start + 100}, 1)
+    # wraps between the 2nd and 3rd samples, same rate
+    rates.update({'rx': 50}, 2)
+    assert rates.rates(1) == {'rx': 100.0}
+    # a burst moves the short horizon more than the long one
+    rates.update({'rx': 50 + 1000}, 3)
+    short, long = rates.rates(1)['rx'], rates.rates(60)['rx']
+    assert 100 < long < short < 1000
+
+
+def test_counter_rates_irregular_interval():
+    rates = CounterRates(('rx',), horizons=(10,))
+    rates.update({'rx': 0}, 0)
+    rates.update({'rx': 100}, 1)
+    rates.update({'rx': 400}, 4)
+    assert rates.rates(10)['rx'] == 100.0
+    # same timestamp, ignored
+    rates.update({'rx': 500}, 4)
+    assert rates.rates(10)['rx'] == 100.0
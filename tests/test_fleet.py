@@ -0,0 +1,137 @@
+import shlex
+import threading
+import time
+
+from cocommon.sys_mon import fleet
+
+from conftest import PROC_ROOT
+
+
+class FixtureConnection(fleet.LocalConnection):
+
+    """Loopback transport dumping the fixture /proc rather than this
+    host's one"""
+
+    delay = 0
+
+    def run(self, command):
+        time.sleep(self.delay)
+        return super(FixtureConnection, self).run(command.replace(
+            'cd /proc', 'cd ' + shlex.quote(PROC_ROOT), 1))
+
+
+class SlowConnection(FixtureConnection):
+
+    delay = 0.15
+
+
+class HangingConnection(FixtureConnection):
+
+    released = threading.Event()
+
+    def run(self, command):
+        self.released.wait(10)
+        return super(HangingConnection, self).run(command)
+
+
+class FailingConnection(FixtureConnection):
+
+    def run(self, command):
+        raise IOError('connection refused')
+
+
+def test_split_dump():
+    data = b'@@@cocommon@@@ stat\ncpu 1\n@@@cocommon@@@ loadavg\n' \
+        b'@@@cocommon@@@ df\nFilesystem\n'
+    assert fleet.split_dump(data) == {
+        'stat': b'cpu 1\n', 'loadavg': b'', 'df': b'Filesystem\n'}
+
+
+def test_remote_reader_of_fixtures():
+    reader = fleet.RemoteStatReader(FixtureConnection())
+    reader.fetch()
+    # the uptime of the host, not the local clock
+    assert reader.timestamp == 12345.67
+    assert reader.read_loadavg()['total'] == 80
+    assert reader.read_pressure('io')['full_total'] == 1000
+    assert reader.read_cpu_usage(per_core=True)['cpu']['usr'] == 4000
+    assert reader.read_network_counters()['eth0']['rx_bytes'] == 1104914
+    reader.close()
+
+
+def test_sample_fixture_hosts():
+    sampler = fleet.FleetSampler(['a', 'b'], connect=FixtureConnection)
+    try:
+        for _ in range(2):
+            snapshots = sampler.sample()
+            assert sorted(snapshots) == ['a', 'b']
+            for snapshot in snapshots.values():
+                assert snapshot['load_info']['load1'] == 0.2
+                assert snapshot['mem_info']['total'] == 16316412
+                assert 'eth0' in snapshot['network_stats']
+                assert 'cgroup_info' not in snapshot
+    finally:
+        sampler.close()
+
+
+def test_sample_this_host():
+    sampler = fleet.FleetSampler(['localhost'],
+                                 connect=fleet.LocalConnection)
+    try:
+        sampler.sample()
+        snapshot = sampler.sample()['localhost']
+        assert 'error' not in snapshot
+        assert set(snapshot['cpu_info']) >= {'usr', 'sys', 'idle'}
+    finally:
+        sampler.close()
+
+
+def test_failing_host():
+    def connect(host):
+        if host == 'bad':
+            return FailingConnection(host)
+        return FixtureConnection(host)
+
+    sampler = fleet.FleetSampler(['good', 'bad'], connect=connect)
+    try:
+        snapshots = sampler.sample()
+        assert 'connection refused' in snapshots['bad']['error']
+        assert 'error' not in snapshots['good']
+    finally:
+        sampler.close()
+
+
+def test_timeout_and_busy_host():
+    def connect(host):
+        if host == 'hung':
+            return HangingConnection(host)
+        return FixtureConnection(host)
+
+    sampler = fleet.FleetSampler(['ok', 'hung'], timeout=0.3,
+                                 connect=connect)
+    try:
+        start = time.monotonic()
+        snapshots = sampler.sample()
+        assert time.monotonic() - start < 2
+        assert snapshots['hung'] == {'error': 'timeout'}
+        assert 'error' not in snapshots['ok']
+        snapshots = sampler.sample()
+        assert snapshots['hung'] == {'error': 'busy with previous sample'}
+        HangingConnection.released.set()
+        time.sleep(0.2)
+        assert 'error' not in sampler.sample()['hung']
+    finally:
+        HangingConnection.released.set()
+        sampler.close()
+
+
+def test_queued_hosts_do_not_time_out():
+    # 4 hosts of 0.15 s one after the other, each within its timeout
+    hosts = ['h{}'.format(i) for i in range(4)]
+    sampler = fleet.FleetSampler(hosts, max_workers=1, timeout=0.3,
+                                 connect=SlowConnection)
+    try:
+        snapshots = sampler.sample()
+        assert [h for h in hosts if 'error' in snapshots[h]] == []
+    finally:
+        sampler.close()
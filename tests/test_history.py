@@ -0,0 +1,127 @@
+import os
+import math
+import mmap
+import struct
+
+import pytest
+
+from cocommon.sys_mon import history
+from cocommon.sys_mon.history import HistoryFile
+
+
+def test_layout(tmp_path):
+    path = str(tmp_path / 'history')
+    f = HistoryFile(path, ['cpu_info.usr', 'mem_info.used'], 5)
+    f.append(1.0, {'cpu_info.usr': 2.0, 'mem_info.used': 3.0})
+    f.flush()
+    f.close()
+
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    magic, version, header_size, record_size, capacity, n_fields, count = \
+        history.HEADER.unpack_from(data, 0)
+    assert (magic, version) == (history.MAGIC, history.LAYOUT_VERSION)
+    assert history.COUNT_OFFSET % 8 == 0
+    assert struct.unpack_from('<Q', data, history.COUNT_OFFSET)[0] == \
+        count == 1
+    assert header_size % mmap.PAGESIZE == 0
+    assert (record_size, capacity, n_fields) == (3 * 8, 5, 2)
+    assert len(data) == header_size + record_size * capacity
+    names_len = struct.unpack_from('<I', data, history.HEADER.size)[0]
+    assert data[history.NAMES_OFFSET:history.NAMES_OFFSET + names_len] == \
+        b'cpu_info.usr\nmem_info.used'
+    assert struct.unpack_from('<3d', data, header_size) == (1.0, 2.0, 3.0)
+
+
+def test_query(tmp_path):
+    path = str(tmp_path / 'history')
+    f = HistoryFile(path, ['a', 'b'], 5)
+    assert len(f) == 0
+    assert f.query() == []
+    for t in range(10):
+        values = {'a': t * 10}
+        if t % 2:
+            values['b'] = t
+        f.append(float(t), values)
+    assert f.count == 10
+    # one slot is kept for the next record
+    assert len(f) == 4
+    assert [r[0] for r in f.query()] == [6.0, 7.0, 8.0, 9.0]
+    records = f.query(7, 8)
+    assert len(records) == 2
+    assert records[0] == (7.0, 70.0, 7.0)
+    # missing values are NaN
+    assert records[1][:2] == (8.0, 80.0)
+    assert math.isnan(records[1][2])
+    assert f.query(7.5, 7.9) == []
+    assert [r[0] for r in f.query(start=8.5)] == [9.0]
+    assert [r[0] for r in f.query(end=0)] == []
+    assert f.column('b') == [(7.0, 7.0), (9.0, 9.0)]
+    f.close()
+
+
+def test_reader_of_another_open(tmp_path):
+    path = str(tmp_path / 'history')
+    writer = HistoryFile(path, ['a'], 3)
+    reader = HistoryFile(path, readonly=True)
+    assert reader.fields == ['a']
+    assert reader.capacity == 3
+    writer.append(1.0, {'a': 1.0})
+    writer.append(2.0, {'a': 2.0})
+    writer.append(3.0, {'a': 3.0})
+    assert reader.query() == [(2.0, 2.0), (3.0, 3.0)]
+    reader.close()
+    writer.close()
+
+
+def test_reopen(tmp_path):
+    path = str(tmp_path / 'history')
+    f = HistoryFile(path, ['a'], 10)
+    f.append(1.0, {'a': 1.0})
+    f.close()
+    f = HistoryFile(path, ['a'], 10)
+    f.append(2.0, {'a': 2.0})
+    assert f.query() == [(1.0, 1.0), (2.0, 2.0)]
+    f.close()
+    assert os.listdir(str(tmp_path)) == ['history']
+
+
+def test_another_layout_is_moved_aside(tmp_path):
+    path = str(tmp_path / 'history')
+    f = HistoryFile(path, ['a'], 10)
+    f.append(1.0, {'a': 1.0})
+    f.close()
+    f = HistoryFile(path, ['a', 'b'], 10)
+    assert f.count == 0
+    f.close()
+    moved = [i for i in os.listdir(str(tmp_path)) if i != 'history']
+    assert len(moved) == 1
+    old = HistoryFile(os.path.join(str(tmp_path), moved[0]), readonly=True)
+    assert old.query() == [(1.0, 1.0)]
+    old.close()
+
+
+def test_invalid(tmp_path):
+    path = str(tmp_path / 'history')
+    with pytest.raises(ValueError):
+        HistoryFile(path, ['a'], 1)
+    with pytest.raises(ValueError):
+        HistoryFile(path, capacity=10)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 4096)
+    with pytest.raises(ValueError):
+        HistoryFile(path, readonly=True)
+
+
+def test_flatten():
+    snapshot = {
+        'cpu_info': {'usr': 1.5, 'sys': 2},
+        'network_info': {'eth0': {'rx': 12.5, 'tx': 0.0}},
+        'process_info': {'1': {'cpu': 1.0}},
+        'flags': {'up': True, 'name': 'x'},
+    }
+    assert history.flatten(snapshot) == {
+        'cpu_info.usr': 1.5, 'cpu_info.sys': 2,
+        'network_info.eth0.rx': 12.5, 'network_info.eth0.tx': 0.0}
+    assert 'network_info.eth0.rx' not in history.flatten(
+        snapshot, ('network_info',))
@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from cocommon.sys_mon.ringbuf import RingBuffer
+
+
+def test_window_after_wrapping():
+    buf = RingBuffer(('a', 'b'), 4)
+    assert len(buf) == 0
+    assert buf.mean() == {}
+    assert buf.delta() == {}
+    for i in range(10):
+        buf.append({'a': i, 'b': 2 * i}, timestamp=i * 0.5)
+    assert len(buf) == 4
+    assert buf.column('a') == [6.0, 7.0, 8.0, 9.0]
+    assert buf.last() == {'a': 9.0, 'b': 18.0}
+    assert buf.mean() == {'a': 7.5, 'b': 15.0}
+    assert buf.delta() == {'a': 3.0, 'b': 6.0}
+    assert buf.rate() == {'a': 1.0, 'b': 2.0}
+    assert buf.elapsed() == 1.5
+    assert buf.per_second() == {'a': 2.0, 'b': 4.0}
+
+
+def test_running_sums_match_the_window():
+    buf = RingBuffer(('x',), 7)
+    values = []
+    rng = random.Random(1)
+    for i in range(1000):
+        v = rng.uniform(-1e6, 1e6)
+        values.append(v)
+        buf.append({'x': v}, timestamp=i)
+        window = values[-7:]
+        assert buf.mean()['x'] == pytest.approx(
+            sum(window) / len(window), rel=1e-9, abs=1e-6)
+
+
+def test_percentile():
+    buf = RingBuffer(('x',), 100)
+    for i in range(101):
+        # 0 is dropped
+        buf.append({'x': 101 - i}, timestamp=i)
+    assert buf.percentile(0) == {'x': 1.0}
+    assert buf.percentile(50) == {'x': 51.0}
+    assert buf.percentile(99) == {'x': 99.0}
+    assert buf.percentile(100) == {'x': 100.0}
+
+
+def test_single_sample():
+    buf = RingBuffer(('x',), 1)
+    buf.append({'x': 1}, timestamp=0)
+    buf.append({'x': 2}, timestamp=1)
+    assert buf.mean() == {'x': 2.0}
+    assert buf.delta() == {}
+    assert buf.per_second() == {}
+
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        RingBuffer(('x',), 0)
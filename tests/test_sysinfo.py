@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+from cocommon.sys_mon.sysinfo import SysMon
+from cocommon.sys_mon.history import HistoryFile
+
+from conftest import PROC_ROOT, rewrite
+
+STAT = '''cpu  {usr} 100 2000 {idle} 500 50 50 0 0 0
+cpu0 2000 50 1000 45000 250 25 25 0 0 0
+cpu1 2000 50 1000 45000 250 25 25 0 0 0
+intr 5266671 16 3084 0 0 0 0 0 0 1 3184
+ctxt {ctxt}
+processes 4936
+procs_running 2
+procs_blocked 1
+'''
+
+CPU_STAT = '''usage_usec {usage}
+user_usec 600000
+system_usec 400000
+nr_periods {periods}
+nr_throttled {throttled}
+throttled_usec 50000
+'''
+
+
+def _tick(proc_root, cgroup_path, usr, idle, ctxt, usage, periods,
+          throttled):
+    rewrite(os.path.join(proc_root, 'stat'),
+            STAT.format(usr=usr, idle=idle, ctxt=ctxt))
+    rewrite(os.path.join(cgroup_path, 'cpu.stat'),
+            CPU_STAT.format(usage=usage, periods=periods,
+                            throttled=throttled))
+
+
+def test_sys_info_of_fixtures(fixture_copy):
+    proc_root, cgroup_root = fixture_copy
+    cgroup_path = os.path.join(cgroup_root, 'system.slice', 'app.scope')
+    output = {}
+    sys_mon = SysMon(output, log_interval=None, proc_root=proc_root,
+                     cgroup_root=cgroup_root)
+
+    _tick(proc_root, cgroup_path, 4000, 90000, 1000, 1000000, 100, 10)
+    first = sys_mon.get_sys_info(now=100.0)
+    assert first['cpu_info'] == {}
+    assert first['load_info']['load1'] == 0.2
+    assert first['pressure_info']['cpu']['some_total'] == 123456
+    assert first['mem_info']['total'] == 16316412
+    assert first['cgroup_info']['cpu_limit'] == 1.5
+    assert first['cgroup_info']['mem_current'] == 102400
+    assert first['cgroup_info']['mem_percent'] == 50.0
+    assert 'cpu_usage' not in first['cgroup_info']
+    assert first['cgroup_pressure']['io']['full_total'] == 3
+
+    # 2 s later: 100 ticks of usr and 300 of idle out of 400
+    _tick(proc_root, cgroup_path, 4100, 90300, 3000, 1750000, 120, 15)
+    second = sys_mon.get_sys_info(now=102.0)
+    assert second['cpu_info']['usr'] == 25.0
+    assert second['cpu_info']['idle'] == 75.0
+    assert second['sched_info']['ctxt'] == 1000.0
+    assert second['sched_info']['procs_blocked'] == 1
+    cgroup_info = second['cgroup_info']
+    # 750 ms of CPU in 2 s
+    assert cgroup_info['cpu_usage'] == 37.5
+    assert cgroup_info['cpu_usage_of_limit'] == 25.0
+    assert cgroup_info['throttled_periods'] == 25.0
+    assert sys_mon.version == 2
+    assert sys_mon.snapshot() is second
+
+
+def test_no_cgroup():
+    sys_mon = SysMon(log_interval=None, proc_root=PROC_ROOT,
+                     cgroup_root=None)
+    snapshot = sys_mon.get_sys_info()
+    assert 'cgroup_info' not in snapshot
+    assert snapshot['network_stats']['eth0'] == {}
+
+
+def test_snapshots_are_frozen():
+    output = {}
+    sys_mon = SysMon(output, log_interval=None, proc_root=PROC_ROOT,
+                     cgroup_root=None)
+    snapshot = sys_mon.get_sys_info()
+    with pytest.raises(TypeError):
+        snapshot['load_info'] = {}
+    with pytest.raises(TypeError):
+        snapshot['load_info']['load1'] = 0
+    # output has its own dicts, changing them leaves the snapshot alone
+    output['load_info']['load1'] = -1
+    assert snapshot['load_info']['load1'] == 0.2
+    assert isinstance(output['load_info'], dict)
+
+
+def test_listeners_and_history_file(tmp_path):
+    seen = []
+    path = str(tmp_path / 'history')
+    sys_mon = SysMon(log_interval=None, proc_root=PROC_ROOT,
+                     cgroup_root=None, history_file=path,
+                     history_capacity=10,
+                     history_fields=['load_info.load1', 'mem_info.total'])
+    sys_mon.add_listener(seen.append)
+    sys_mon.get_sys_info()
+    sys_mon.get_sys_info()
+    assert len(seen) == 2
+    assert seen[1] is sys_mon.snapshot()
+    reader = HistoryFile(path, readonly=True)
+    assert reader.fields == ['load_info.load1', 'mem_info.total']
+    assert [r[1:] for r in reader.query()] == [(0.2, 16316412.0)] * 2
+    reader.close()
+
+
+def test_unknown_history_family():
+    with pytest.raises(ValueError):
+        SysMon(history={'network': 60}, proc_root=PROC_ROOT,
+               cgroup_root=None)
@@ -0,0 +1,148 @@
+import os
+
+from cocommon.sys_mon import sysstat
+
+from conftest import PROC_ROOT, CGROUP_ROOT, CGROUP_PATH, rewrite
+
+
+def _read(*parts):
+    with open(os.path.join(*parts), 'rb') as f:
+        return f.read()
+
+
+def test_parse_cpu_stat():
+    stat = sysstat.parse_cpu_stat(_read(PROC_ROOT, 'stat'))
+    assert stat['cpu']['usr'] == 4000
+    assert stat['cpu']['idle'] == 90000
+    assert set(stat['cpu']) == set(sysstat.CPU_FIELDS)
+    assert sorted(stat['cores']) == ['cpu0', 'cpu1']
+    assert stat['cores']['cpu1']['softirq'] == 25
+    # only the total of intr
+    assert stat['intr'] == 5266671
+    assert stat['ctxt'] == 18558358
+    assert stat['processes'] == 4936
+    assert stat['procs_running'] == 2
+    assert stat['procs_blocked'] == 1
+
+
+def test_parse_cpu_stat_old_kernel():
+    # no steal, guest and guest_nice before 2.6.11
+    stat = sysstat.parse_cpu_stat(b'cpu  1 2 3 4 5 6 7\ncpu0 1 2 3 4 5 6 7\n')
+    assert stat['cpu']['softirq'] == 7
+    assert stat['cpu']['steal'] == 0
+    assert stat['cores']['cpu0']['guest_nice'] == 0
+
+
+def test_parse_diskstats():
+    data = _read(PROC_ROOT, 'diskstats')
+    disk_io = sysstat.parse_diskstats(data)
+    assert sorted(disk_io) == ['sda', 'sda1']
+    assert disk_io['sda']['reads'] == 31478
+    assert disk_io['sda']['write_sectors'] == 25030696
+    assert disk_io['sda']['weighted_io_ms'] == 1978452
+    # discard and flush fields of newer kernels are ignored
+    assert set(disk_io['sda1']) == set(sysstat.DISKSTATS_FIELDS)
+    assert 'loop0' in sysstat.parse_diskstats(data, skip_idle=False)
+
+
+def test_parse_pressure():
+    cpu = sysstat.parse_pressure(_read(PROC_ROOT, 'pressure', 'cpu'))
+    assert cpu == {'some_avg10': 1.5, 'some_avg60': 0.75,
+                   'some_avg300': 0.25, 'some_total': 123456}
+    io = sysstat.parse_pressure(_read(PROC_ROOT, 'pressure', 'io'))
+    assert io['full_avg10'] == 1.0
+    assert io['full_total'] == 1000
+    assert isinstance(io['some_total'], int)
+
+
+def test_parse_loadavg():
+    assert sysstat.parse_loadavg(_read(PROC_ROOT, 'loadavg')) == {
+        'load1': 0.2, 'load5': 0.18, 'load15': 0.12,
+        'running': 1, 'total': 80}
+
+
+def test_parse_network_counters():
+    counters = sysstat.parse_network_counters(_read(PROC_ROOT, 'net', 'dev'))
+    assert sorted(counters) == ['eth0', 'lo']
+    eth0 = counters['eth0']
+    assert len(eth0) == len(sysstat.NETDEV_FIELDS) == 16
+    assert eth0['rx_bytes'] == 1104914
+    assert eth0['rx_errs'] == 1
+    assert eth0['rx_multicast'] == 3
+    assert eth0['tx_drop'] == 4
+
+
+def test_find_cgroup(tmp_path):
+    assert sysstat.find_cgroup(PROC_ROOT, CGROUP_ROOT) == CGROUP_PATH
+
+    # the root cgroup, as on a host
+    (tmp_path / 'self').mkdir()
+    (tmp_path / 'self' / 'cgroup').write_bytes(b'0::/\n')
+    assert sysstat.find_cgroup(str(tmp_path), CGROUP_ROOT) is None
+
+    # cgroup v1 only
+    (tmp_path / 'self' / 'cgroup').write_bytes(
+        b'4:memory:/user.slice\n2:cpu,cpuacct:/user.slice\n')
+    assert sysstat.find_cgroup(str(tmp_path), CGROUP_ROOT) is None
+
+    assert sysstat.find_cgroup(str(tmp_path / 'none'), CGROUP_ROOT) is None
+
+
+def test_parse_cgroup_files():
+    assert sysstat.parse_cgroup_cpu_max(b'150000 100000\n') == 1.5
+    assert sysstat.parse_cgroup_cpu_max(b'max 100000\n') is None
+    assert sysstat.parse_cgroup_memory_max(b'209715200\n') == 209715200
+    assert sysstat.parse_cgroup_memory_max(b'max\n') is None
+    assert sysstat.parse_cgroup_io_stat(_read(CGROUP_PATH, 'io.stat')) == {
+        '8:0': {'rbytes': 90112, 'wbytes': 4096, 'rios': 11, 'wios': 1,
+                'dbytes': 0, 'dios': 0}}
+    cpu_stat = sysstat.parse_flat_keyed(_read(CGROUP_PATH, 'cpu.stat'))
+    assert cpu_stat['usage_usec'] == 1000000
+    assert cpu_stat['nr_throttled'] == 10
+
+
+def test_cgroup_reader():
+    reader = sysstat.CgroupReader(CGROUP_PATH)
+    try:
+        assert reader.read_cpu_max() == 1.5
+        assert reader.read_memory() == {'current': 104857600,
+                                        'max': 209715200}
+        assert reader.read_io_stat()['8:0']['rios'] == 11
+        assert reader.read_pressure('io')['some_total'] == 7
+    finally:
+        reader.close()
+
+
+def test_cgroup_reader_without_controllers(tmp_path):
+    (tmp_path / 'cpu.stat').write_bytes(b'usage_usec 0\n')
+    (tmp_path / 'memory.current').write_bytes(b'4096\n')
+    reader = sysstat.CgroupReader(str(tmp_path))
+    try:
+        assert reader.read_cpu_max() is None
+        assert reader.read_memory() == {'current': 4096, 'max': None}
+        assert reader.read_io_stat() == {}
+    finally:
+        reader.close()
+
+
+def test_proc_stat_reader_rereads(fixture_copy):
+    proc_root, _ = fixture_copy
+    reader = sysstat.ProcStatReader(proc_root)
+    try:
+        assert reader.read_loadavg()['load1'] == 0.2
+        # the file is kept open, and read again from the start
+        rewrite(os.path.join(proc_root, 'loadavg'),
+                '1.50 0.18 0.12 3/80 11206\n')
+        assert reader.read_loadavg()['load1'] == 1.5
+        assert reader.read_loadavg()['running'] == 3
+    finally:
+        reader.close()
+
+
+def test_proc_reader_grows_buffer(tmp_path):
+    path = tmp_path / 'big'
+    content = b'x' * 10000
+    path.write_bytes(content)
+    with sysstat.ProcReader(str(path), bufsize=16) as reader:
+        assert reader.read() == content
+        assert reader.read() == content